@@ -0,0 +1,57 @@
+"""Peak memory of inference() as the driving audio gets longer.
+
+Each audio length runs in a fresh process, so the reported peak RSS belongs to
+that run alone. With --streaming the peak should stay flat as the audio grows.
+
+    python benchmark_memory.py --video data/video/yongen.mp4 --lengths 10 60 300 600 --streaming
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+CHILD = """
+import resource
+from lipsync.engine import InferenceEngine
+InferenceEngine().inference({audio!r}, {video!r}, 0, streaming={streaming})
+print("peak_rss_kb", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def make_audio(path, seconds, sr=16000):
+    # Amplitude-modulated tones so the model sees something speech-like
+    t = np.arange(int(seconds * sr)) / sr
+    wave = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    sf.write(path, wave.astype(np.float32), sr)
+
+
+def run(video, seconds, streaming, tmp_dir):
+    audio = os.path.join(tmp_dir, f"bench_{seconds}s.wav")
+    make_audio(audio, seconds)
+    code = CHILD.format(audio=audio, video=video, streaming=streaming)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in out.stdout.splitlines():
+        if line.startswith("peak_rss_kb"):
+            return int(line.split()[1]) / 1024
+    print(out.stderr[-2000:])
+    raise RuntimeError(f"benchmark run for {seconds}s audio failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", type=str, required=True, help="Reference video or image")
+    parser.add_argument("--lengths", type=float, nargs="+", default=[10, 60, 300], help="Audio lengths in seconds")
+    parser.add_argument("--streaming", action="store_true", help="Run inference in streaming mode")
+    args = parser.parse_args()
+
+    video = os.path.abspath(args.video)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'audio (s)':>10}  {'peak RSS (MB)':>14}")
+        for seconds in args.lengths:
+            peak = run(video, seconds, args.streaming, tmp_dir)
+            print(f"{seconds:>10.0f}  {peak:>14.0f}")
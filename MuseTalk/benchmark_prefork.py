@@ -0,0 +1,35 @@
+"""Memory density of the pre-forked worker pool.
+
+For each worker count, the pool serves one job per worker at the same time
+and the RSS and PSS of every process are printed afterwards. Compare the
+total PSS with workers x the RSS of a single standalone process to see how
+much the shared weights save.
+
+    python benchmark_prefork.py --audio data/audio/yongen.wav --video data/video/yongen.mp4 --workers 1 2 4
+"""
+import argparse
+
+from lipsync.engine import InferenceEngine
+from lipsync.prefork import PreforkWorkerPool
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", type=str, required=True, help="Driving audio")
+    parser.add_argument("--video", type=str, required=True, help="Reference video or image")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to measure")
+    args = parser.parse_args()
+
+    engine = InferenceEngine(device="cpu").load()
+    for num_workers in args.workers:
+        pool = PreforkWorkerPool(engine, num_workers).start()
+        try:
+            # Distinct output names, the jobs render the same clip at the same time
+            futures = [pool.submit(args.audio, args.video, 0, output_vid_name=f"prefork_{k}.mp4")
+                       for k in range(num_workers)]
+            for future in futures:
+                future.result()
+            print(f"--- {num_workers} workers")
+            print(pool.report())
+        finally:
+            pool.close()
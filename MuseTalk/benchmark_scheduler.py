@@ -0,0 +1,106 @@
+"""Synthetic multi-job load test of the micro-batching scheduler.
+
+Several jobs run concurrently, each sending its frames to the model in
+batches of --job_batch_size, with a ragged last batch like datagen. The same
+load is run twice: with every job calling the model itself (one at a time,
+as on a shared GPU), and through one MicroBatchScheduler. Throughput, batch
+fill and per-request latency are reported for both.
+
+    python benchmark_scheduler.py --jobs 4 --frames 100 250
+    python benchmark_scheduler.py --jobs 8 --simulate   # cost model instead of the real models
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+import torch
+
+from lipsync.scheduler import MicroBatchScheduler
+
+
+def simulated_predict(overhead, per_frame):
+    """A model whose batch cost is a fixed overhead plus a per-frame cost."""
+    def predict(whisper_batch, latent_batch):
+        time.sleep(overhead + per_frame * len(whisper_batch))
+        return np.zeros((len(whisper_batch), 256, 256, 3), dtype=np.uint8)
+    return predict
+
+
+def job_batches(num_frames, job_batch_size, device, dtype):
+    for start in range(0, num_frames, job_batch_size):
+        n = min(job_batch_size, num_frames - start)
+        yield (torch.randn(n, 50, 384, device=device, dtype=dtype),
+               torch.randn(n, 8, 32, 32, device=device, dtype=dtype))
+
+
+def run_jobs(job_lengths, job_batch_size, run_batch, device, dtype):
+    """Run one thread per job; returns (wall time, per-request latencies)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def job(num_frames):
+        for whisper_batch, latent_batch in job_batches(num_frames, job_batch_size, device, dtype):
+            start = time.perf_counter()
+            run_batch(whisper_batch, latent_batch)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=job, args=(n,)) for n in job_lengths]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def print_result(name, frames, wall, latencies):
+    print(f"{name:>10}: {frames / wall:7.1f} frames/s, "
+          f"request latency p50 {np.percentile(latencies, 50) * 1000:6.0f} ms, "
+          f"p95 {np.percentile(latencies, 95) * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=4, help="Concurrent jobs")
+    parser.add_argument("--frames", type=int, nargs=2, default=[100, 250], help="Min and max frames per job")
+    parser.add_argument("--job_batch_size", type=int, default=8, help="Frames per request from each job")
+    parser.add_argument("--batch_size", type=int, default=16, help="Scheduler batch size")
+    parser.add_argument("--max_wait", type=float, default=0.02, help="Scheduler max wait in seconds")
+    parser.add_argument("--simulate", action="store_true", help="Use a cost model instead of loading the models")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.simulate:
+        predict = simulated_predict(overhead=0.03, per_frame=0.004)
+        device, dtype = torch.device("cpu"), torch.float32
+    else:
+        from lipsync.engine import InferenceEngine
+        engine = InferenceEngine().load().warmup(args.batch_size)
+        predict, device, dtype = engine.predict, engine.device, engine.weight_dtype
+
+    random.seed(args.seed)
+    job_lengths = [random.randint(*args.frames) for _ in range(args.jobs)]
+    frames = sum(job_lengths)
+    print(f"{args.jobs} jobs, {frames} frames, job batch size {args.job_batch_size}")
+
+    model_lock = threading.Lock()
+
+    @torch.no_grad()
+    def direct(whisper_batch, latent_batch):
+        with model_lock:
+            return predict(whisper_batch, latent_batch)
+
+    wall, latencies = run_jobs(job_lengths, args.job_batch_size, direct, device, dtype)
+    print_result("per-job", frames, wall, latencies)
+
+    with MicroBatchScheduler(predict, batch_size=args.batch_size, max_wait=args.max_wait) as scheduler:
+        wall, latencies = run_jobs(
+            job_lengths, args.job_batch_size,
+            lambda whisper_batch, latent_batch: scheduler.submit(whisper_batch, latent_batch).result(),
+            device, dtype,
+        )
+        print_result("scheduler", frames, wall, latencies)
+        print(scheduler.report())
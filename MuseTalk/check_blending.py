@@ -0,0 +1,58 @@
+"""Check that FrameCompositor blends byte-identically to upstream get_image.
+
+Random frames, faces and boxes (some reaching past the right or bottom edge
+of the frame) are blended with musetalk.utils.blending.get_image and with
+FrameCompositor, both into a new buffer and in place into the source frame,
+which must be restored exactly afterwards.
+
+    python check_blending.py --cases 300
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+from musetalk.utils.blending import get_image
+from musetalk.utils.face_parsing import FaceParsing
+from lipsync.compositor import FrameCompositor
+
+
+def random_case(rng):
+    height, width = int(rng.integers(240, 720)), int(rng.integers(240, 1280))
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    box_w = int(rng.integers(40, min(height, width) // 2))
+    box_h = int(rng.integers(40, min(height, width) // 2))
+    # Up to a quarter of the box may lie past the right or bottom edge
+    x1 = int(rng.integers(0, width - box_w * 3 // 4))
+    y1 = int(rng.integers(0, height - box_h * 3 // 4))
+    face = rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    return frame, (x1, y1, x1 + box_w, y1 + box_h), face
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=300, help="Random cases to check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fp = FaceParsing(left_cheek_width=90, right_cheek_width=90)
+    failures = 0
+    for case in range(args.cases):
+        frame, box, face = random_case(rng)
+        mode = ("jaw", "raw")[case % 2]
+        x1, y1, x2, y2 = box
+        y2 = min(y2, frame.shape[0])  # as inference() clips it
+
+        expected = get_image(frame.copy(), cv2.resize(face, (x2 - x1, y2 - y1)), [x1, y1, x2, y2], mode=mode, fp=fp)
+        compositor = FrameCompositor([frame], [box], 0, mode, fp)
+        original = frame.copy()
+        copied = compositor(0, face)
+        with compositor.blended(0, face) as in_place:
+            in_place_ok = np.array_equal(in_place, expected)
+        ok = np.array_equal(copied, expected) and in_place_ok and np.array_equal(frame, original)
+        if not ok:
+            failures += 1
+            print(f"case {case}: mismatch, frame {frame.shape[1]}x{frame.shape[0]}, box {box}, mode {mode}")
+    print(f"{args.cases - failures}/{args.cases} cases byte-identical")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,50 @@
+"""Export pe, the UNet and the VAE decoder to ONNX for the onnxruntime backend.
+
+After exporting, the ONNX Runtime path is checked against PyTorch on random
+inputs, and the script exits non-zero if the outputs drift past the
+tolerances.
+
+    python export_onnx.py --out models/onnx
+    python app.py --backend onnxruntime --onnx_dir models/onnx
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+from lipsync.engine import CheckpointsDir
+from lipsync.onnx_backend import OnnxRuntimeModels, compare_with_torch, export_onnx
+from musetalk.utils.utils import load_all_model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=str, default=os.path.join(CheckpointsDir, "onnx"), help="Output directory")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--skip_export", action="store_true", help="Only run the equivalence check")
+    parser.add_argument("--latents_atol", type=float, default=1e-3, help="Max abs difference of the UNet output")
+    parser.add_argument("--image_atol", type=int, default=2, help="Max abs difference of the decoded uint8 crops")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    vae, unet, pe = load_all_model(
+        unet_model_path=os.path.join(CheckpointsDir, "musetalkV15", "unet.pth"),
+        vae_type="sd-vae",
+        unet_config=os.path.join(CheckpointsDir, "musetalkV15", "musetalk.json"),
+        device=device
+    )
+    pe = pe.float().to(device).eval()
+    vae.vae = vae.vae.float().to(device).eval()
+    unet.model = unet.model.float().to(device).eval()
+
+    if not args.skip_export:
+        export_onnx(pe, unet, vae, args.out, opset=args.opset)
+
+    diff = compare_with_torch(OnnxRuntimeModels(args.out), pe, unet, vae)
+    print(f"UNet latents max abs diff: {diff['latents_max_abs']:.2e} (atol {args.latents_atol:.0e})")
+    print(f"decoded crops max abs diff: {diff['image_max_abs']} (atol {args.image_atol})")
+    if diff["latents_max_abs"] > args.latents_atol or diff["image_max_abs"] > args.image_atol:
+        print("ONNX Runtime output does not match PyTorch")
+        sys.exit(1)
+    print("ONNX Runtime output matches PyTorch")
@@ -0,0 +1,108 @@
+import contextlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import torch
+
+from lipsync.avatar_cache import hash_path
+
+
+def audio_key(audio_path, **params):
+    """Cache key from the audio content plus the chunking params (fps, padding, dtype)."""
+    h = hash_path(audio_path)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class WhisperChunkCache:
+    """LRU cache of whisper_chunks keyed by audio content.
+
+    Chunks are kept on the CPU in memory, up to max_bytes, and moved to the
+    requested device on a hit. If disk_dir is set, entries are also written
+    there as <key>.pt, so they survive restarts and memory evictions. The disk
+    tier evicts the least recently used files past max_disk_bytes. The memory
+    tier is locked and the disk tier treats a file removed by another job as a
+    miss, so concurrent inference() calls and worker processes can share it.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, disk_dir=None, max_disk_bytes=10 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def _remember(self, key, chunks):
+        size = chunks.element_size() * chunks.nelement()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = chunks
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.element_size() * evicted.nelement()
+
+    def get(self, key, device="cpu"):
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is not None:
+                self._entries.move_to_end(key)
+        if chunks is not None:
+            return chunks.to(device)
+        if self.disk_dir:
+            # Other jobs and worker processes share the directory and may evict or
+            # replace the file at any point, so a vanished file is just a miss
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    chunks = torch.load(f, map_location="cpu")
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                print(f"Warning: ignoring unreadable whisper cache entry {key}: {e}")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                return None
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(path)
+            self._remember(key, chunks)
+            return chunks.to(device)
+        return None
+
+    def put(self, key, chunks):
+        chunks = chunks.detach().cpu()
+        self._remember(key, chunks)
+        if self.disk_dir:
+            tmp_path = os.path.join(self.disk_dir, f".tmp-{uuid.uuid4().hex}.pt")
+            torch.save(chunks, tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".pt") and not name.startswith(".tmp-"):
+                try:
+                    files.append((os.path.getmtime(path), path, os.path.getsize(path)))
+                except FileNotFoundError:  # evicted by another job meanwhile
+                    continue
+        total = sum(size for _, _, size in files)
+        for _, path, size in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
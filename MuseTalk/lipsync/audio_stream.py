@@ -0,0 +1,72 @@
+import math
+
+import torch
+
+
+class StreamingWhisperChunks:
+    """Per-frame whisper chunks computed lazily, one 30 s segment at a time.
+
+    Produces the same chunks as AudioProcessor.get_whisper_chunk, but instead of
+    encoding the whole clip and materializing a [num_frames, 50, 384] tensor up
+    front, each 30 s mel segment is run through the Whisper encoder when the
+    first frame that needs it is requested. Only the last two encoded segments
+    are kept, so memory does not grow with audio length. Iterate it in order,
+    e.g. through datagen.
+    """
+
+    def __init__(self, audio_processor, whisper, audio_path, device, weight_dtype, fps=25,
+                 audio_padding_length_left=2, audio_padding_length_right=2):
+        self.features, librosa_length = audio_processor.get_audio_feature(audio_path)
+        self.whisper = whisper
+        self.device = device
+        self.weight_dtype = weight_dtype
+
+        sr = 16000
+        audio_fps = 50
+        fps = int(fps)
+        self.whisper_idx_multiplier = audio_fps / fps
+        self.num_frames = math.floor((librosa_length / sr) * fps)
+        self.actual_length = math.floor((librosa_length / sr) * audio_fps)
+        self.pad_left = math.ceil(self.whisper_idx_multiplier) * audio_padding_length_left
+        self.clip_length = 2 * (audio_padding_length_left + audio_padding_length_right + 1)
+        self._segments = {}
+        first = self._segment(0)
+        self.segment_length = first.shape[0]
+        self._row_shape, self._dtype, self._device = first.shape[1:], first.dtype, first.device
+
+    def __len__(self):
+        return self.num_frames
+
+    @torch.no_grad()
+    def _segment(self, s):
+        if s not in self._segments:
+            input_feature = self.features[s].to(self.device).to(self.weight_dtype)
+            audio_feats = self.whisper.encoder(input_feature, output_hidden_states=True).hidden_states
+            self._segments[s] = torch.stack(audio_feats, dim=2)[0]  # [1500, layers, 384]
+            for old in [k for k in self._segments if k < s - 1]:
+                del self._segments[old]
+        return self._segments[s]
+
+    def _padded(self, start, end):
+        """Rows [start, end) of the zero-padded whisper feature sequence."""
+        out = torch.zeros((end - start,) + self._row_shape, dtype=self._dtype, device=self._device)
+        t = max(start - self.pad_left, 0)
+        t_end = min(end - self.pad_left, self.actual_length)
+        while t < t_end:
+            s, offset = divmod(t, self.segment_length)
+            n = min(t_end - t, self.segment_length - offset)
+            row = t + self.pad_left - start
+            out[row:row + n] = self._segment(s)[offset:offset + n]
+            t += n
+        return out
+
+    def __getitem__(self, frame_index):
+        if not 0 <= frame_index < self.num_frames:
+            raise IndexError(frame_index)
+        audio_index = math.floor(frame_index * self.whisper_idx_multiplier)
+        audio_clip = self._padded(audio_index, audio_index + self.clip_length)
+        return audio_clip.reshape(-1, audio_clip.shape[-1])  # [clip_length * layers, 384]
+
+    def __iter__(self):
+        for frame_index in range(self.num_frames):
+            yield self[frame_index]
@@ -0,0 +1,173 @@
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+import numpy as np
+import torch
+
+
+def hash_path(path, h=None, chunk_size=1 << 20):
+    """Feed the content of a file, or of every file in a folder, into a sha256."""
+    h = h or hashlib.sha256()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            h.update(name.encode())
+            hash_path(os.path.join(path, name), h, chunk_size)
+        return h
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h
+
+
+def avatar_key(video_path, **params):
+    """Cache key from the reference video content plus the preparation params.
+
+    Two uploads with the same name but different content get different keys,
+    and the same video prepared with a different bbox_shift/extra_margin does
+    not reuse stale boxes.
+    """
+    h = hash_path(video_path)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class AvatarCache:
+    """Size-bounded on-disk cache of avatar preparation results.
+
+    Each entry is a directory named by the avatar key holding the bbox list,
+    the raw face landmarks, the 256x256 face crops and the VAE latents.
+    Entries are evicted least recently used first once the cache grows past
+    max_bytes; a hit refreshes the entry's mtime.
+
+    Concurrent jobs, in threads or in forked workers, share the cache: reads,
+    replacements and evictions hold a thread lock plus an flock on
+    <cache_dir>/.lock, so no entry is removed while another job reads it.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, open(os.path.join(self.cache_dir, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _num_frames(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, "meta.json")) as f:
+                return json.load(f).get("num_frames", 0)
+        except (OSError, ValueError):
+            return -1
+
+    def load(self, key, device="cpu", min_frames=0):
+        """Return the cached entry as a dict, or None on a miss.
+
+        Entries may only cover a prefix of the video (see inference()); an
+        entry with fewer than min_frames frames counts as a miss. The crops are
+        memory-mapped, not read, as inference() only needs boxes and latents.
+        """
+        entry_dir = self._entry_dir(key)
+        with contextlib.ExitStack() as files:
+            try:
+                # Only validating the entry and opening its files needs the lock; an
+                # eviction after that does not affect files that are already open
+                with self._locked():
+                    meta_path = os.path.join(entry_dir, "meta.json")
+                    if not os.path.exists(meta_path):
+                        return None
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    if meta.get("num_frames", 0) < min_frames:
+                        return None
+                    coords_file = files.enter_context(open(os.path.join(entry_dir, "coords.pkl"), 'rb'))
+                    landmarks_file = files.enter_context(open(os.path.join(entry_dir, "landmarks.pkl"), 'rb'))
+                    latents_file = files.enter_context(open(os.path.join(entry_dir, "latents.pt"), 'rb'))
+                    crops = np.load(os.path.join(entry_dir, "crops.npy"), mmap_mode="r")
+                    os.utime(entry_dir)
+                coord_list = pickle.load(coords_file)
+                landmarks = pickle.load(landmarks_file)
+                latents = torch.load(latents_file, map_location=device)
+            except Exception as e:
+                print(f"Warning: ignoring unreadable avatar cache entry {key}: {e}")
+                with self._locked():
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+        return {
+            "coord_list": coord_list,
+            "landmarks": landmarks,
+            "crops": crops,
+            "latents": list(latents.split(1)) if latents.numel() else [],
+        }
+
+    def save(self, key, coord_list, crops, latents, landmarks):
+        entry_dir = self._entry_dir(key)
+        # Write into a temp dir and rename so readers never see half an entry
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            with open(os.path.join(tmp_dir, "coords.pkl"), 'wb') as f:
+                pickle.dump(coord_list, f)
+            with open(os.path.join(tmp_dir, "landmarks.pkl"), 'wb') as f:
+                pickle.dump(landmarks, f)
+            crops = np.stack(crops) if len(crops) else np.zeros((0, 256, 256, 3), dtype=np.uint8)
+            np.save(os.path.join(tmp_dir, "crops.npy"), crops)
+            latents = torch.cat([l.cpu() for l in latents]) if len(latents) else torch.zeros(0)
+            torch.save(latents, os.path.join(tmp_dir, "latents.pt"))
+            with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+                json.dump({"num_frames": len(coord_list)}, f)
+            with self._locked():
+                # Another job may have saved this video meanwhile; keep whichever covers more frames
+                if self._num_frames(entry_dir) < len(coord_list):
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    try:
+                        os.replace(tmp_dir, entry_dir)
+                    except OSError:
+                        # Recreated by a writer outside this lock (e.g. another host); as good as ours
+                        if not os.path.isdir(entry_dir):
+                            raise
+                self._evict(keep=key)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _entry_size(self, entry_dir):
+        return sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+
+    def _evict(self, keep=None):
+        # Called with the lock held
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            entries.append((os.path.getmtime(entry_dir), name, self._entry_size(entry_dir)))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
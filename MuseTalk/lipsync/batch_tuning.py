@@ -0,0 +1,109 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+import torch
+
+
+def _is_oom(e):
+    return isinstance(e, MemoryError) or "out of memory" in str(e).lower()
+
+
+def measure_throughput(run_batch, batch_size, repeats=2):
+    """Frames per second of run_batch(batch_size), after one warmup call."""
+    run_batch(batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        run_batch(batch_size)
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+class BatchSizeTuner:
+    """Pick the inference batch size by measuring throughput.
+
+    Starting from 1, the batch size is doubled until frames/s improves by less
+    than min_gain, max_batch_size is reached or the device runs out of memory.
+    The result is cached per key (device and dtype) in memory and in a JSON
+    file, so probing happens once per machine and precision. Tuning holds a
+    thread lock and an flock on <cache_path>.lock, so concurrent jobs and
+    worker processes neither probe at the same time (which would distort each
+    other's timings) nor tune a key twice.
+    """
+
+    def __init__(self, cache_path, max_batch_size=64, min_gain=0.05, repeats=2):
+        self.cache_path = cache_path
+        self.max_batch_size = max_batch_size
+        self.min_gain = min_gain
+        self.repeats = repeats
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._read()
+
+    def _read(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                self._cache.update(json.load(f))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        with self._lock, open(f"{self.cache_path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        # A temp file per writer, concurrent processes must not share one
+        with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix=".tmp", delete=False) as f:
+            json.dump(self._cache, f, indent=2)
+        os.replace(f.name, self.cache_path)
+
+    def tune(self, run_batch):
+        best_size, best_fps = 1, 0.0
+        batch_size = 1
+        while batch_size <= self.max_batch_size:
+            try:
+                fps = measure_throughput(run_batch, batch_size, self.repeats)
+            except (RuntimeError, MemoryError) as e:
+                if not _is_oom(e):
+                    raise
+                print(f"batch size {batch_size}: out of memory")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                break
+            print(f"batch size {batch_size}: {fps:.1f} frames/s")
+            if fps > best_fps:
+                gain = fps / best_fps - 1 if best_fps else float("inf")
+                best_size, best_fps = batch_size, fps
+                if gain < self.min_gain:
+                    break
+            else:
+                break
+            batch_size *= 2
+        return best_size
+
+    def get(self, key, run_batch):
+        """Return the cached batch size for key, probing with run_batch on a miss."""
+        if key not in self._cache:
+            with self._locked():
+                # Another job or process may have tuned it while this one waited
+                self._read()
+                if key not in self._cache:
+                    print(f"tuning inference batch size for {key}")
+                    self._cache[key] = self.tune(run_batch)
+                    self._save()
+        return self._cache[key]
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from musetalk.utils.blending import face_seg, get_crop_box
+
+
+# get_image() from musetalk.utils.blending, split in two. The face-parsing mask
+# only depends on the source frame and the box, never on the generated face, so
+# it can be computed once and reused for every output frame with the same source.
+# Together with get_image_blended_into this gives byte-identical results to get_image.
+
+def get_image_mask(image, face_box, upper_boundary_ratio=0.5, expand=1.5, mode="raw", fp=None, seg_image=None):
+    """Return (mask_array, crop_box), the blending mask get_image would build.
+
+    seg_image is the face_seg output for the crop, if already computed.
+    """
+    body = Image.fromarray(image[:, :, ::-1])
+
+    x, y, x1, y1 = face_box
+    crop_box, s = get_crop_box(face_box, expand)
+    x_s, y_s, x_e, y_e = crop_box
+
+    face_large = body.crop(crop_box)
+    ori_shape = face_large.size
+
+    mask_image = seg_image if seg_image is not None else face_seg(face_large, mode=mode, fp=fp)
+    mask_small = mask_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+    mask_image = Image.new('L', ori_shape, 0)
+    mask_image.paste(mask_small, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+
+    # keep upper_boundary_ratio of talking area
+    width, height = mask_image.size
+    top_boundary = int(height * upper_boundary_ratio)
+    modified_mask_image = Image.new('L', ori_shape, 0)
+    modified_mask_image.paste(mask_image.crop((0, top_boundary, width, height)), (0, top_boundary))
+
+    blur_kernel_size = int(0.05 * ori_shape[0] // 2 * 2) + 1
+    mask_array = cv2.GaussianBlur(np.array(modified_mask_image), (blur_kernel_size, blur_kernel_size), 0)
+    return mask_array, crop_box
+
+
+def blend_region(crop_box, shape):
+    """Slices of the part of crop_box inside a frame of this shape, the only pixels blending changes."""
+    height, width = shape[:2]
+    x_s, y_s, x_e, y_e = crop_box
+    return slice(max(y_s, 0), min(y_e, height)), slice(max(x_s, 0), min(x_e, width))
+
+
+def get_image_blended_into(out, image, face, face_box, mask_array, crop_box):
+    """Paste the generated face into image using a mask from get_image_mask, writing into out.
+
+    Only the crop box region is converted and blended; the rest of the frame is
+    a plain copy of image. The paste runs through PIL on the region alone, and
+    since blending is per channel the BGR data needs no flip, so the result is
+    byte-identical to get_image. out may be image itself to blend in place.
+    """
+    x, y, x1, y1 = face_box
+    x_s, y_s, x_e, y_e = crop_box
+    if out is not image:
+        np.copyto(out, image)
+
+    # The crop box can reach past the frame edge; only the part inside can change
+    rows, cols = blend_region(crop_box, image.shape)
+    cx0, cy0, cx1, cy1 = cols.start, rows.start, cols.stop, rows.stop
+    if cx1 <= cx0 or cy1 <= cy0:
+        return out
+
+    face_large = image[cy0:cy1, cx0:cx1].copy()
+    fx0, fy0, fx1, fy1 = max(x, cx0), max(y, cy0), min(x1, cx1), min(y1, cy1)
+    if fx1 > fx0 and fy1 > fy0:
+        face_large[fy0 - cy0:fy1 - cy0, fx0 - cx0:fx1 - cx0] = face[fy0 - y:fy1 - y, fx0 - x:fx1 - x]
+    mask = mask_array[cy0 - y_s:cy1 - y_s, cx0 - x_s:cx1 - x_s]
+
+    roi = Image.fromarray(out[cy0:cy1, cx0:cx1])
+    roi.paste(Image.fromarray(face_large), (0, 0), Image.fromarray(np.ascontiguousarray(mask)))
+    out[cy0:cy1, cx0:cx1] = np.asarray(roi)
+    return out
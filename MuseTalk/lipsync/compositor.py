@@ -0,0 +1,203 @@
+import contextlib
+import multiprocessing as mp
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+import torch
+
+from lipsync.blending import blend_region, get_image_blended_into
+from lipsync.face_masks import FaceMaskCache
+
+
+def source_index(i, num_frames):
+    """Source frame of output frame i in the ping-pong cycle (0..n-1, n-1..0)."""
+    j = i % (2 * num_frames)
+    return j if j < num_frames else 2 * num_frames - 1 - j
+
+
+class FrameCompositor:
+    """Blend generated 256x256 faces back into the source frames.
+
+    Output frame i uses source frame and box i of the ping-pong cycle
+    (frames + frames[::-1]). Returns None when the box cannot be used, in which
+    case the frame is dropped like before. Face-parsing masks come from a
+    FaceMaskCache, so each source frame is parsed once however often the
+    cycle revisits it.
+    """
+
+    def __init__(self, frames, coords, extra_margin, parsing_mode, fp, mask_batch_size=8):
+        self.frames = frames
+        self.coords = coords
+        self.extra_margin = extra_margin
+        self.masks = FaceMaskCache(fp, parsing_mode, batch_size=mask_batch_size)
+
+    def _source(self, i):
+        return source_index(i, len(self.frames))
+
+    def source_frame(self, i):
+        """The untouched source frame behind output frame i."""
+        return self.frames[self._source(i)]
+
+    def _box(self, src):
+        x1, y1, x2, y2 = self.coords[src]
+        y2 = y2 + self.extra_margin
+        y2 = min(y2, self.frames[src].shape[0])
+        return [x1, y1, x2, y2]
+
+    def prepare(self, indices):
+        """Parse the source frames of output frames indices in batched passes."""
+        items = []
+        for src in sorted({self._source(i) for i in indices}):
+            x1, y1, x2, y2 = box = self._box(src)
+            if x2 > x1 and y2 > y1:
+                items.append((src, self.frames[src], box))
+        self.masks.prepare(items)
+
+    def _resized(self, src, res_frame):
+        x1, y1, x2, y2 = self._box(src)
+        try:
+            return cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
+        except:
+            return None
+
+    def __call__(self, i, res_frame, out=None):
+        """Blend output frame i into out (allocated if None) and return it."""
+        src = self._source(i)
+        ori_frame = self.frames[src]
+        box = self._box(src)
+        res_frame = self._resized(src, res_frame)
+        if res_frame is None:
+            return None
+
+        # v15 blending, byte-identical to get_image but only the face region is blended
+        mask_array, crop_box = self.masks.get(src, ori_frame, box)
+        if out is None:
+            out = np.empty_like(ori_frame)
+        return get_image_blended_into(out, ori_frame, res_frame, box, mask_array, crop_box)
+
+    @contextlib.contextmanager
+    def blended(self, i, res_frame, weight=1.0):
+        """Blend output frame i into its source frame, in place, for the duration of the block.
+
+        Only the crop box region is saved beforehand and restored afterwards, so
+        no full-resolution frame is copied. weight < 1 crossfades the region
+        towards the source. Yields None when the box cannot be used. The frame
+        must be consumed (e.g. written to the encoder) inside the block.
+        """
+        src = self._source(i)
+        ori_frame = self.frames[src]
+        box = self._box(src)
+        res_frame = self._resized(src, res_frame)
+        if res_frame is None:
+            yield None
+            return
+        mask_array, crop_box = self.masks.get(src, ori_frame, box)
+        region = blend_region(crop_box, ori_frame.shape)
+        saved = ori_frame[region].copy()
+        try:
+            get_image_blended_into(ori_frame, ori_frame, res_frame, box, mask_array, crop_box)
+            if weight < 1:
+                blended = ori_frame[region]
+                cv2.addWeighted(blended, weight, saved, 1 - weight, 0, dst=blended)
+            yield ori_frame
+        finally:
+            ori_frame[region] = saved
+
+
+# Per-worker state, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(frames, out_frames, coords, extra_margin, parsing_mode, fp):
+    # One thread per worker, the pool itself provides the parallelism
+    torch.set_num_threads(1)
+    # frames and fp (with BiSeNet loaded) are inherited through the fork, nothing is copied or reloaded
+    _worker["compositor"] = FrameCompositor(frames, coords, extra_margin, parsing_mode, fp)
+    _worker["out_frames"] = out_frames
+
+
+def _composite_task(i, res_frame, slot, weight):
+    # Blend straight into the shared output slot
+    compositor = _worker["compositor"]
+    out = compositor(i, res_frame, out=_worker["out_frames"][slot])
+    if out is None:
+        return False
+    if weight < 1:
+        # Crossfade towards the source frame, at the edges of a silent span
+        cv2.addWeighted(out, weight, compositor.source_frame(i), 1 - weight, 0, dst=out)
+    return True
+
+
+class CompositorPool:
+    """Run FrameCompositor in worker processes, keeping output order.
+
+    The workers are forked, so they inherit the source frames and the face
+    parser fp (with BiSeNet loaded) copy-on-write. Workers write each result
+    into one of a ring of shared output slots, so only the small 256x256
+    faces are pickled. Results are handed to on_frame(i, frame) in submission
+    order, frame being a view of the slot that is only valid for the duration
+    of the callback. A frame that takes longer than timeout seconds raises
+    RuntimeError.
+
+    Forking is only safe for CPU-only setups (a forked child cannot use a CUDA
+    context initialized by the parent) and while no other thread is running
+    models, see InferenceEngine.inference.
+    """
+
+    def __init__(self, frames, coords, extra_margin, parsing_mode, fp, num_workers, on_frame, timeout=120):
+        self.on_frame = on_frame
+        self.timeout = timeout
+
+        # Two slots per worker keep every worker busy while the parent drains results
+        num_slots = 2 * num_workers
+        out_shape = (num_slots,) + frames[0].shape
+        self._out_shm = SharedMemory(create=True, size=int(np.prod(out_shape)))
+        self._out_frames = np.ndarray(out_shape, dtype=np.uint8, buffer=self._out_shm.buf)
+        self._free = deque(range(num_slots))
+        self._pending = deque()
+
+        self._pool = mp.get_context("fork").Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(frames, self._out_frames, coords, extra_margin, parsing_mode, fp),
+        )
+
+    def submit(self, i, res_frame, weight=1.0):
+        """Blend res_frame into output frame i; weight < 1 mixes in the source frame."""
+        if not self._free:
+            self._pop()
+        slot = self._free.popleft()
+        self._pending.append((self._pool.apply_async(_composite_task, (i, res_frame, slot, weight)), slot, i))
+
+    def _pop(self):
+        result, slot, i = self._pending.popleft()
+        try:
+            # A worker killed mid-task never reports back, so do not wait forever
+            done = result.get(timeout=self.timeout)
+        except mp.TimeoutError:
+            raise RuntimeError(f"Compositing worker gave no result within {self.timeout} s, it may have crashed")
+        if done:
+            self.on_frame(i, self._out_frames[slot])
+        self._free.append(slot)
+
+    def flush(self):
+        while self._pending:
+            self._pop()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        # Drop every view of the shared buffer (the pool holds one in its initargs) before closing
+        self._pool = None
+        del self._out_frames
+        self._out_shm.close()
+        self._out_shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,869 @@
+import functools
+import os
+import subprocess
+import threading
+import uuid
+from argparse import Namespace
+from itertools import islice
+
+from lipsync.pipeline import Pipeline
+from lipsync.video_writer import FFmpegVideoWriter, HLSVideoWriter, HLSSegmentWatcher
+
+ProjectDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CheckpointsDir = os.path.join(ProjectDir, "models")
+
+
+def missing_models(checkpoints_dir=CheckpointsDir):
+    """Names of the required model files that are not in checkpoints_dir."""
+    required_models = {
+        "MuseTalk": f"{checkpoints_dir}/musetalkV15/unet.pth",
+        "MuseTalk config": f"{checkpoints_dir}/musetalkV15/musetalk.json",
+        "SD VAE": f"{checkpoints_dir}/sd-vae/config.json",
+        "Whisper": f"{checkpoints_dir}/whisper/config.json",
+        "DWPose": f"{checkpoints_dir}/dwpose/dw-ll_ucoco_384.pth",
+        "SyncNet": f"{checkpoints_dir}/syncnet/latentsync_syncnet.pt",
+        "Face Parse": f"{checkpoints_dir}/face-parse-bisent/79999_iter.pth",
+        "ResNet": f"{checkpoints_dir}/face-parse-bisent/resnet18-5c106cde.pth"
+    }
+    return [name for name, path in required_models.items() if not os.path.exists(path)]
+
+
+def fast_check_ffmpeg():
+    try:
+        subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
+        return True
+    except:
+        return False
+
+
+def source_type(video_path):
+    """"video", "image" or "folder" (of numbered images) for a reference input.
+
+    Extends get_file_type to images with other extensions (.webp, ...) that
+    cv2 can still decode; anything else that is not a folder is rejected.
+    """
+    import cv2
+    from musetalk.utils.utils import get_file_type
+
+    file_type = get_file_type(video_path)
+    if file_type != "unsupported":
+        return file_type
+    if os.path.isdir(video_path):
+        return "folder"
+    if os.path.isfile(video_path) and cv2.imread(video_path) is not None:
+        return "image"
+    raise ValueError(f"Unsupported reference input {video_path!r}, expected a video, an image or a folder of images")
+
+
+def _read_first_frame(video_path):
+    """First frame of a video, or the image itself, as BGR."""
+    import cv2
+    import imageio
+    from musetalk.utils.utils import get_file_type
+
+    if get_file_type(video_path) == "video":
+        reader = imageio.get_reader(video_path)
+        first_frame = reader.get_data(0)
+        reader.close()
+        return cv2.cvtColor(first_frame, cv2.COLOR_RGB2BGR)
+    return cv2.imread(video_path)
+
+
+def _counted(fn):
+    """Count the calls of a method that are running, in self.active_jobs."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._jobs_lock:
+            self.active_jobs += 1
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            with self._jobs_lock:
+                self.active_jobs -= 1
+    return wrapper
+
+
+def _no_grad(fn):
+    """torch.no_grad() as a method decorator, without importing torch at import time."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        import torch
+        with torch.no_grad():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class InferenceEngine:
+    """MuseTalk models plus the inference entry points, with nothing done at import.
+
+    Importing this module only pulls in the standard library; torch, the
+    models and the face detectors are imported and loaded by load(), or on the
+    first inference call. warmup() runs one synthetic batch so the first
+    request does not pay for kernel selection and allocator growth. The Gradio
+    app, the RunPod wrapper and the benchmarks all share this class.
+
+    With backend="onnxruntime", pe, the UNet and the VAE decoder run on ONNX
+    Runtime's CPU provider from the graphs written by export_onnx.py; Whisper
+    and the VAE encoder (used once per avatar) stay on PyTorch.
+
+    With quantize="int8" (CPU only), the Linear layers of Whisper and, on the
+    torch backend, of the UNet are dynamically quantized; the onnxruntime
+    backend uses the statically quantized UNet written by quantize_int8.py.
+
+    precision is "fp32", "fp16" (same as use_float16=True) or "bf16". bf16
+    casts Whisper, pe, the UNet and the VAE, except the VAE decoder's output
+    layers, which stay in fp32.
+
+    Usage:
+        engine = InferenceEngine(precision="bf16", device="cpu").load().warmup()
+        output_path, bbox_shift_text = engine.inference(audio_path, video_path, 0)
+    """
+
+    def __init__(self, checkpoints_dir=CheckpointsDir, device=None, use_float16=False, backend="torch",
+                 onnx_dir=None, num_threads=0, quantize=None, precision=None):
+        precision = precision or ("fp16" if use_float16 else "fp32")
+        if precision not in ("fp32", "fp16", "bf16"):
+            raise ValueError(f"Unknown precision {precision!r}, expected 'fp32', 'fp16' or 'bf16'")
+        if backend not in ("torch", "onnxruntime"):
+            raise ValueError(f"Unknown backend {backend!r}, expected 'torch' or 'onnxruntime'")
+        if quantize not in (None, "int8"):
+            raise ValueError(f"Unknown quantization {quantize!r}, expected None or 'int8'")
+        if backend == "onnxruntime" and precision != "fp32":
+            raise ValueError(f"The onnxruntime backend runs float32 graphs, {precision} is not supported")
+        if quantize and precision != "fp32":
+            raise ValueError(f"int8 quantization starts from float32 weights, {precision} is not supported")
+        self.checkpoints_dir = checkpoints_dir
+        # ONNX Runtime sessions and quantized kernels only run on the CPU
+        self.device = "cpu" if backend == "onnxruntime" or quantize else device
+        self.precision = precision
+        self.backend = backend
+        self.quantize = quantize
+        self.onnx_dir = onnx_dir or os.path.join(checkpoints_dir, "onnx")
+        self.num_threads = num_threads
+        self.ort = None
+        self.scheduler = None
+        self.active_jobs = 0  # inference() calls running right now
+        self._jobs_lock = threading.Lock()
+        self._face_parsers = {}
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return self
+        missing = missing_models(self.checkpoints_dir)
+        if missing:
+            raise FileNotFoundError(f"Missing model files: {', '.join(missing)}; run download_weights.sh first")
+
+        import torch
+        from transformers import WhisperModel
+        from musetalk.utils.audio_processor import AudioProcessor
+        from musetalk.utils.utils import load_all_model
+        from lipsync.audio_cache import WhisperChunkCache
+        from lipsync.avatar_cache import AvatarCache
+        from lipsync.batch_tuning import BatchSizeTuner
+        from lipsync.precision import PRECISIONS, keep_float32
+
+        # load model weights
+        device = torch.device(self.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        vae, unet, pe = load_all_model(
+            unet_model_path=os.path.join(self.checkpoints_dir, "musetalkV15", "unet.pth"),
+            vae_type="sd-vae",
+            unet_config=os.path.join(self.checkpoints_dir, "musetalkV15", "musetalk.json"),
+            device=device
+        )
+
+        # Set data type
+        weight_dtype = PRECISIONS[self.precision]
+        if weight_dtype != torch.float32:
+            # Convert models to half precision for better performance
+            pe = pe.to(weight_dtype)
+            vae.vae = vae.vae.to(weight_dtype)
+            unet.model = unet.model.to(weight_dtype)
+        if self.precision == "bf16":
+            # bf16 only has an 8-bit mantissa; the decoder's last layers map latents
+            # to pixel values, where that shows up as banding, so they fall back to fp32
+            keep_float32(vae.vae.decoder.conv_norm_out)
+            keep_float32(vae.vae.decoder.conv_out)
+
+        # Move models to specified device
+        self.pe = pe.to(device)
+        vae.vae = vae.vae.to(device)
+        unet.model = unet.model.to(device)
+        self.vae, self.unet = vae, unet
+        self.device, self.weight_dtype = device, weight_dtype
+        # Integer timesteps; the UNet casts its time embedding to the sample dtype
+        self.timesteps = torch.tensor([0], device=device)
+
+        if self.backend == "onnxruntime":
+            from lipsync.onnx_backend import OnnxRuntimeModels
+            self.ort = OnnxRuntimeModels(self.onnx_dir, num_threads=self.num_threads, quantize=self.quantize)
+            # The UNet weights are only needed by the torch path
+            self.unet.model = None
+        elif self.quantize == "int8":
+            from lipsync.quantization import quantize_dynamic_int8
+            quantize_dynamic_int8(self.unet.model)
+
+        # Initialize audio processor and Whisper model
+        whisper_dir = os.path.join(self.checkpoints_dir, "whisper")
+        self.audio_processor = AudioProcessor(feature_extractor_path=whisper_dir)
+        whisper = WhisperModel.from_pretrained(whisper_dir)
+        self.whisper = whisper.to(device=device, dtype=weight_dtype).eval()
+        self.whisper.requires_grad_(False)
+        if self.quantize == "int8":
+            # pe is a fixed sinusoidal table with no weights, so Whisper and the UNet are what get quantized
+            from lipsync.quantization import quantize_dynamic_int8
+            quantize_dynamic_int8(self.whisper)
+
+        # Whisper features keyed by audio content; the disk tier is only used if WHISPER_CACHE_DIR is set
+        self.whisper_cache = WhisperChunkCache(
+            max_bytes=int(float(os.getenv("WHISPER_CACHE_MAX_GB", "1")) * 1024 ** 3),
+            disk_dir=os.getenv("WHISPER_CACHE_DIR") or None,
+        )
+
+        # Batch sizes chosen by batch_size="auto", probed once per device/dtype
+        self.batch_size_tuner = BatchSizeTuner(os.getenv("BATCH_SIZE_CACHE") or "./results/batch_size.json")
+
+        # Persistent cache of avatar preparation (boxes, crops, VAE latents), keyed by video content
+        self.avatar_cache = AvatarCache(
+            os.getenv("AVATAR_CACHE_DIR") or "./results/avatar_cache",
+            max_bytes=int(float(os.getenv("AVATAR_CACHE_MAX_GB", "10")) * 1024 ** 3),
+        )
+
+        self.loaded = True
+        return self
+
+    def face_parser(self, left_cheek_width=90, right_cheek_width=90):
+        """FaceParsing for these cheek widths, built (and BiSeNet loaded) once per engine."""
+        from musetalk.utils.face_parsing import FaceParsing
+        key = (left_cheek_width, right_cheek_width)
+        if key not in self._face_parsers:
+            self._face_parsers[key] = FaceParsing(left_cheek_width=left_cheek_width, right_cheek_width=right_cheek_width)
+        return self._face_parsers[key]
+
+    def enable_batching(self, batch_size=16, max_wait=0.02):
+        """Send the model calls of all concurrent inference() calls through one MicroBatchScheduler."""
+        from lipsync.scheduler import MicroBatchScheduler
+        self.load()
+        if self.scheduler is None:
+            self.scheduler = MicroBatchScheduler(self.predict, batch_size=batch_size, max_wait=max_wait).start()
+        return self
+
+    def warmup(self, batch_size=1):
+        """Run one synthetic batch through pe, the UNet and the VAE decoder."""
+        self.load()
+        self.run_synthetic_batch(batch_size)
+        return self
+
+    def predict(self, whisper_batch, latent_batch):
+        """pe -> UNet -> VAE decode for one batch; returns the BGR uint8 crops."""
+        if self.ort is not None:
+            return self.ort.predict(whisper_batch, latent_batch)
+        # Ensure both batches are consistent with model weight type (cached chunks
+        # and latents may come from another precision's run)
+        audio_feature_batch = self.pe(whisper_batch.to(dtype=self.weight_dtype))
+        latent_batch = latent_batch.to(dtype=self.weight_dtype)
+        pred_latents = self.unet.model(latent_batch, self.timesteps, encoder_hidden_states=audio_feature_batch).sample
+        return self.vae.decode_latents(pred_latents)
+
+    @_no_grad
+    def run_synthetic_batch(self, batch_size):
+        """One pe -> UNet -> VAE decode pass on random inputs, used to time batch sizes."""
+        import torch
+        whisper_batch = torch.randn(batch_size, 50, 384, device=self.device, dtype=self.weight_dtype)
+        latent_batch = torch.randn(batch_size, 8, 32, 32, device=self.device, dtype=self.weight_dtype)
+        self.predict(whisper_batch, latent_batch)
+
+    def resolve_batch_size(self, batch_size):
+        if batch_size != "auto":
+            return int(batch_size)
+        import torch
+        device_name = torch.cuda.get_device_name(self.device) if self.device.type == "cuda" else "cpu"
+        key = f"{device_name}-{self.weight_dtype}-{self.backend}" + (f"-{self.quantize}" if self.quantize else "")
+        return self.batch_size_tuner.get(key, self.run_synthetic_batch)
+
+    @_no_grad
+    def debug_inpainting(self, video_path, bbox_shift, extra_margin=10, parsing_mode="jaw", 
+                        left_cheek_width=90, right_cheek_width=90):
+        """Debug inpainting parameters, only process the first frame"""
+        import cv2
+        import numpy as np
+        import torch
+        from musetalk.utils.blending import get_image
+        from musetalk.utils.preprocessing import coord_placeholder
+        from lipsync.preprocessing import get_landmark_and_bbox_from_frames
+
+        self.load()
+        device, vae, weight_dtype = self.device, self.vae, self.weight_dtype
+
+        # Set default parameters
+        args_dict = {
+            "result_dir": './results/debug', 
+            "fps": 25, 
+            "batch_size": 1, 
+            "output_vid_name": '', 
+            "use_saved_coord": False,
+            "audio_padding_length_left": 2,
+            "audio_padding_length_right": 2,
+            "version": "v15",
+            "extra_margin": extra_margin,
+            "parsing_mode": parsing_mode,
+            "left_cheek_width": left_cheek_width,
+            "right_cheek_width": right_cheek_width
+        }
+        args = Namespace(**args_dict)
+
+        # Create debug directory
+        os.makedirs(args.result_dir, exist_ok=True)
+    
+        # Read first frame
+        first_frame = _read_first_frame(video_path)
+
+        # Save first frame
+        debug_frame_path = os.path.join(args.result_dir, "debug_frame.png")
+        cv2.imwrite(debug_frame_path, first_frame)
+    
+        # Get face coordinates
+        coord_list, frame_list = get_landmark_and_bbox_from_frames([first_frame], bbox_shift)
+        bbox = coord_list[0]
+        frame = frame_list[0]
+    
+        if bbox == coord_placeholder:
+            return None, "No face detected, please adjust bbox_shift parameter"
+    
+        # Initialize face parser
+        fp = self.face_parser(args.left_cheek_width, args.right_cheek_width)
+    
+        # Process first frame
+        x1, y1, x2, y2 = bbox
+        y2 = y2 + args.extra_margin
+        y2 = min(y2, frame.shape[0])
+        crop_frame = frame[y1:y2, x1:x2]
+        crop_frame = cv2.resize(crop_frame,(256,256),interpolation = cv2.INTER_LANCZOS4)
+    
+        # Generate random audio features
+        random_audio = torch.randn(1, 50, 384, device=device, dtype=weight_dtype)
+    
+        # Get latents
+        latents = vae.get_latents_for_unet(crop_frame)
+    
+        # Generate prediction results
+        recon = self.predict(random_audio, latents)
+    
+        # Inpaint back to original image
+        res_frame = recon[0]
+        res_frame = cv2.resize(res_frame.astype(np.uint8),(x2-x1,y2-y1))
+        combine_frame = get_image(frame, res_frame, [x1, y1, x2, y2], mode=args.parsing_mode, fp=fp)
+    
+        # Save results (no need to convert color space again since get_image already returns RGB format)
+        debug_result_path = os.path.join(args.result_dir, "debug_result.png")
+        cv2.imwrite(debug_result_path, combine_frame)
+    
+        # Create information text
+        info_text = f"Parameter information:\n" + \
+                    f"bbox_shift: {bbox_shift}\n" + \
+                    f"extra_margin: {extra_margin}\n" + \
+                    f"parsing_mode: {parsing_mode}\n" + \
+                    f"left_cheek_width: {left_cheek_width}\n" + \
+                    f"right_cheek_width: {right_cheek_width}\n" + \
+                    f"Detected face coordinates: [{x1}, {y1}, {x2}, {y2}]"
+    
+        return cv2.cvtColor(combine_frame, cv2.COLOR_RGB2BGR), info_text
+
+    @_no_grad
+    def debug_inpainting_sweep(self, video_path, bbox_shifts=(0,), extra_margins=(10,), parsing_modes=("jaw",),
+                               left_cheek_widths=(90,), right_cheek_widths=(90,), cell_width=320, seed=0):
+        """debug_inpainting over a grid of parameter values, in one call.
+
+        Landmarks are detected once per distinct bbox_shift, every distinct crop
+        (bbox_shift x extra_margin) is encoded and run through pe, the UNet and
+        the VAE decoder in a single batch, and the blends for the full grid are
+        tiled into a labelled contact sheet. All cells use the same random audio,
+        so they differ only by their parameters. Returns the sheet (RGB, like
+        debug_inpainting) and one line of information per cell.
+        """
+        import itertools
+        import math
+        import cv2
+        import numpy as np
+        import torch
+        from musetalk.utils.blending import get_image
+        from musetalk.utils.preprocessing import coord_placeholder
+        from lipsync.latents import get_latents_for_unet_batch
+        from lipsync.preprocessing import get_landmark_and_bbox_from_frames
+
+        grid_values = [list(values) for values in
+                       (bbox_shifts, extra_margins, parsing_modes, left_cheek_widths, right_cheek_widths)]
+        if not all(grid_values):
+            return None, "Empty parameter sweep, give at least one value for every parameter"
+        bbox_shifts, extra_margins, parsing_modes, left_cheek_widths, right_cheek_widths = grid_values
+        unknown_modes = [mode for mode in parsing_modes if mode not in ("jaw", "raw")]
+        if unknown_modes:
+            return None, f"Unknown parsing modes {unknown_modes}, expected 'jaw' or 'raw'"
+
+        self.load()
+        result_dir = './results/debug'
+        os.makedirs(result_dir, exist_ok=True)
+        frame = _read_first_frame(video_path)
+
+        # Face boxes per bbox_shift, then the crop for every (bbox_shift, extra_margin)
+        boxes = {}
+        for bbox_shift in dict.fromkeys(bbox_shifts):
+            coord_list, _ = get_landmark_and_bbox_from_frames([frame], bbox_shift)
+            boxes[bbox_shift] = coord_list[0]
+        crop_keys, crops = [], []
+        for bbox_shift, extra_margin in itertools.product(dict.fromkeys(bbox_shifts), dict.fromkeys(extra_margins)):
+            if boxes[bbox_shift] == coord_placeholder:
+                continue
+            x1, y1, x2, y2 = boxes[bbox_shift]
+            y2 = min(y2 + extra_margin, frame.shape[0])
+            crop_keys.append((bbox_shift, extra_margin))
+            crops.append(cv2.resize(frame[y1:y2, x1:x2], (256, 256), interpolation=cv2.INTER_LANCZOS4))
+
+        # One encoder pass and one pe -> UNet -> VAE batch for all crops
+        recon = {}
+        if crops:
+            latents = torch.cat(get_latents_for_unet_batch(self.vae, crops, batch_size=len(crops)))
+            generator = torch.Generator().manual_seed(seed)
+            random_audio = torch.randn(1, 50, 384, generator=generator).to(self.device, self.weight_dtype)
+            recon = dict(zip(crop_keys, self.predict(random_audio.expand(len(crops), -1, -1), latents)))
+
+        cells, info = [], []
+        grid = itertools.product(bbox_shifts, extra_margins, parsing_modes, left_cheek_widths, right_cheek_widths)
+        for bbox_shift, extra_margin, parsing_mode, left_cheek_width, right_cheek_width in grid:
+            label = f"shift {bbox_shift} margin {extra_margin} {parsing_mode} cheeks {left_cheek_width}/{right_cheek_width}"
+            if (bbox_shift, extra_margin) not in recon:
+                cell = np.full_like(frame, 64)
+                info.append(f"{label}: no face detected")
+            else:
+                x1, y1, x2, y2 = boxes[bbox_shift]
+                y2 = min(y2 + extra_margin, frame.shape[0])
+                res_frame = cv2.resize(recon[(bbox_shift, extra_margin)].astype(np.uint8), (x2 - x1, y2 - y1))
+                fp = self.face_parser(left_cheek_width, right_cheek_width)
+                cell = get_image(frame, res_frame, [x1, y1, x2, y2], mode=parsing_mode, fp=fp)
+                info.append(f"{label}: face [{x1}, {y1}, {x2}, {y2}]")
+            height = round(cell.shape[0] * cell_width / cell.shape[1])
+            cell = cv2.resize(cell, (cell_width, height), interpolation=cv2.INTER_AREA)
+            cv2.putText(cell, label, (6, 18), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(cell, label, (6, 18), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+            cells.append(cell)
+
+        columns = math.ceil(math.sqrt(len(cells)))
+        cells += [np.zeros_like(cells[0])] * (-len(cells) % columns)
+        rows = [np.hstack(cells[k:k + columns]) for k in range(0, len(cells), columns)]
+        sheet = np.vstack(rows)
+        cv2.imwrite(os.path.join(result_dir, "debug_sweep.png"), sheet)
+        return cv2.cvtColor(sheet, cv2.COLOR_BGR2RGB), "\n".join(info)
+
+    @_counted
+    @_no_grad
+    def inference(self, audio_path, video_path, bbox_shift, extra_margin=10, parsing_mode="jaw", 
+                  left_cheek_width=90, right_cheek_width=90,
+                  dump_frames=False, video_preset="medium", video_crf=18, video_threads=0,
+                  landmark_stride=1, landmark_batch_size=8, vae_batch_size=16, pipeline_queue_size=4, composite_workers=0,
+                  batch_size=8, streaming=False, progressive=False, segment_duration=2.0, on_segment=None,
+                  output_vid_name="", skip_silence=False, silence_mode="source", silence_threshold_db=-40.0,
+                  silence_fade_frames=3):
+        """Lip-sync video_path to audio_path; returns (output path, bbox_shift range text)."""
+        import cv2
+        import numpy as np
+        import torch
+        from tqdm import tqdm
+        from musetalk.utils.utils import get_video_fps, datagen
+        from musetalk.utils.preprocessing import coord_placeholder
+        from lipsync.frames import iter_video_frames, iter_image_folder
+        from lipsync.preprocessing import aligned_frame_count, bbox_range_text, get_landmark_and_bbox_keyframes
+        from lipsync.avatar_cache import avatar_key
+        from lipsync.latents import get_latents_for_unet_batch
+        from lipsync.compositor import FrameCompositor, CompositorPool, source_index
+        from lipsync.audio_cache import audio_key
+        from lipsync.audio_stream import StreamingWhisperChunks
+        from lipsync.vad import frame_energy, speech_mask, crossfade_weights
+
+        if silence_mode not in ("source", "closed"):
+            raise ValueError(f"Unknown silence mode {silence_mode!r}, expected 'source' or 'closed'")
+
+        self.load()
+        device, vae, weight_dtype = self.device, self.vae, self.weight_dtype
+
+        # Set default parameters, aligned with inference.py
+        args_dict = {
+            "result_dir": './results/output', 
+            "fps": 25, 
+            "batch_size": batch_size,  # or "auto" to use the tuned batch size for this device/dtype
+            "streaming": streaming,  # encode whisper features window by window, for long audio
+            "progressive": progressive,  # write an HLS playlist of fMP4 segments while rendering
+            "segment_duration": segment_duration,  # seconds per HLS segment
+            "output_vid_name": output_vid_name,  # file name under result_dir, defaults to <video>_<audio>.mp4 (<name>_hls/ when progressive)
+            "use_avatar_cache": True,
+            "audio_padding_length_left": 2,
+            "audio_padding_length_right": 2,
+            "version": "v15",  # Fixed use v15 version
+            "extra_margin": extra_margin,
+            "parsing_mode": parsing_mode,
+            "left_cheek_width": left_cheek_width,
+            "right_cheek_width": right_cheek_width,
+            "dump_frames": dump_frames,  # also write source/result frames as PNG, for debugging only
+            "video_preset": video_preset,  # libx264 preset of the output encode
+            "video_crf": video_crf,
+            "video_threads": video_threads,  # 0 lets ffmpeg pick
+            "landmark_stride": landmark_stride,  # >1 detects on keyframes only and tracks boxes in between
+            "landmark_batch_size": landmark_batch_size,  # full-resolution frames per face detector / DWPose call
+            "vae_batch_size": vae_batch_size,  # crops per VAE encoder call
+            "pipeline_queue_size": pipeline_queue_size,  # batches buffered between model, compositing and encoding
+            "composite_workers": composite_workers,  # >0 blends in that many worker processes (CPU only)
+            "skip_silence": skip_silence,  # frames in silent spans skip the model and are passed through
+            "silence_mode": silence_mode,  # "source" frame or a "closed"-mouth render during silence
+            "silence_threshold_db": silence_threshold_db,  # below this, relative to the loudest frame, is silence
+            "silence_fade_frames": silence_fade_frames  # crossfade length at the edges of a silent span
+        }
+        args = Namespace(**args_dict)
+
+        # Check ffmpeg
+        if not fast_check_ffmpeg():
+            print("Warning: Unable to find ffmpeg, please ensure ffmpeg is properly installed")
+
+        input_basename = os.path.basename(video_path).split('.')[0]
+        audio_basename = os.path.basename(audio_path).split('.')[0]
+        output_basename = f"{input_basename}_{audio_basename}"
+    
+        # Create temporary directory
+        temp_dir = os.path.join(args.result_dir, f"{args.version}")
+        os.makedirs(temp_dir, exist_ok=True)
+    
+        # Set result save path
+        result_img_save_path = os.path.join(temp_dir, output_basename)
+        if args.dump_frames:
+            os.makedirs(result_img_save_path, exist_ok=True)
+
+        if args.progressive:
+            # One directory per job: a shared one would mix the segments of concurrent
+            # jobs on same-named inputs, or of an earlier run, into the playlist
+            hls_name = os.path.splitext(args.output_vid_name)[0] or f"{output_basename}_{uuid.uuid4().hex[:8]}"
+            output_vid_name = os.path.join(temp_dir, hls_name+"_hls", "index.m3u8")
+        elif args.output_vid_name == "":
+            output_vid_name = os.path.join(temp_dir, output_basename+".mp4")
+        else:
+            output_vid_name = os.path.join(temp_dir, args.output_vid_name)
+        
+        file_type = source_type(video_path)
+        fps = get_video_fps(video_path) if file_type == "video" else args.fps
+
+        ############################################## extract audio feature ##############################################
+        # Identical audio (retries, one TTS clip on several avatars) skips Whisper entirely
+        whisper_key = audio_key(
+            audio_path,
+            fps=fps,
+            audio_padding_length_left=args.audio_padding_length_left,
+            audio_padding_length_right=args.audio_padding_length_right,
+            dtype=str(weight_dtype),
+            quantize=self.quantize,  # int8 Whisper gives slightly different features
+        )
+        whisper_chunks = None if args.streaming else self.whisper_cache.get(whisper_key, device=device)
+        if args.streaming:
+            # Whisper runs one 30 s segment at a time as datagen walks the frames, so
+            # nothing sized by the audio length is held in memory
+            whisper_chunks = StreamingWhisperChunks(
+                self.audio_processor,
+                self.whisper,
+                audio_path,
+                device,
+                weight_dtype,
+                fps=fps,
+                audio_padding_length_left=args.audio_padding_length_left,
+                audio_padding_length_right=args.audio_padding_length_right,
+            )
+        elif whisper_chunks is not None:
+            print("using cached whisper features")
+        else:
+            # Extract audio features
+            whisper_input_features, librosa_length = self.audio_processor.get_audio_feature(audio_path)
+            whisper_chunks = self.audio_processor.get_whisper_chunk(
+                whisper_input_features, 
+                device, 
+                weight_dtype, 
+                self.whisper, 
+                librosa_length,
+                fps=fps,
+                audio_padding_length_left=args.audio_padding_length_left,
+                audio_padding_length_right=args.audio_padding_length_right,
+            )
+            self.whisper_cache.put(whisper_key, whisper_chunks)
+
+        ############################################## extract frames from source video ##############################################
+        # Output frame i uses source frame i of the ping-pong cycle (0..L-1, L-1..0), so
+        # only the first min(len(whisper_chunks), L) source frames are ever reached.
+        # Stop decoding there so landmarks, latents and masks are only computed for those.
+        num_needed = len(whisper_chunks)
+        # With landmark_stride > 1, prepare up to the next stride-th frame so the boxes of
+        # the needed frames match those of any longer (e.g. cached) run of this video
+        num_prepared = aligned_frame_count(num_needed, args.landmark_stride)
+        if file_type == "video":
+            # Decode straight into memory; PNGs are only written in debug mode
+            save_dir_full = os.path.join(temp_dir, input_basename) if args.dump_frames else None
+            frame_list = list(islice(iter_video_frames(video_path, dump_dir=save_dir_full), num_prepared))
+        elif file_type == "image":
+            # A still image is prepared once; the cycle below repeats it for as long as the audio lasts
+            frame_list = [cv2.imread(video_path)]
+        else: # input img folder
+            frame_list = list(islice(iter_image_folder(video_path), num_prepared))
+        if not frame_list:
+            raise ValueError(f"No frames could be read from {video_path}")
+
+        ############################################## preprocess input image  ##############################################
+        # Face boxes, crops and latents only depend on the video content and these params
+        cache_key = avatar_key(
+            video_path,
+            bbox_shift=bbox_shift,
+            extra_margin=args.extra_margin,
+            landmark_stride=args.landmark_stride,
+            version=args.version,
+            dtype=str(vae.vae.dtype),
+        )
+        cached = self.avatar_cache.load(cache_key, device=device, min_frames=len(frame_list)) if args.use_avatar_cache else None
+        if cached is not None:
+            print("using cached avatar preparation")
+            coord_list = cached["coord_list"]
+            landmarks = cached["landmarks"]
+            input_latent_list = cached["latents"]
+        else:
+            print("extracting landmarks...time consuming")
+            # One batched detection pass gives the boxes and the landmarks for the bbox_shift
+            # range together; stride 1 detects on every frame
+            coord_list, landmarks, _ = get_landmark_and_bbox_keyframes(
+                frame_list, bbox_shift, stride=args.landmark_stride, batch_size=args.landmark_batch_size)
+
+            crop_list = []
+            for bbox, frame in zip(coord_list, frame_list):
+                if bbox == coord_placeholder:
+                    continue
+                x1, y1, x2, y2 = bbox
+                y2 = y2 + args.extra_margin
+                y2 = min(y2, frame.shape[0])
+                crop_frame = frame[y1:y2, x1:x2]
+                crop_frame = cv2.resize(crop_frame,(256,256),interpolation = cv2.INTER_LANCZOS4)
+                crop_list.append(crop_frame)
+            input_latent_list = get_latents_for_unet_batch(vae, crop_list, batch_size=args.vae_batch_size)
+            if args.use_avatar_cache:
+                self.avatar_cache.save(cache_key, coord_list, crop_list, input_latent_list, landmarks)
+
+        # Keep the frames this audio needs; the cache entry or the aligned run may cover more
+        frame_list = frame_list[:num_needed]
+        coord_list = coord_list[:len(frame_list)]
+        num_latents = sum(bbox != coord_placeholder for bbox in coord_list)
+        input_latent_list = input_latent_list[:num_latents]
+        # Summarize the bbox_shift range over exactly these frames, hit or miss
+        bbox_shift_text = bbox_range_text(landmarks[:len(frame_list)], bbox_shift)
+        print(f"using {len(frame_list)} source frames for {num_needed} output frames")
+
+        # Initialize face parser
+        fp = self.face_parser(args.left_cheek_width, args.right_cheek_width)
+
+        # to smooth the first and the last frame
+        input_latent_list_cycle = input_latent_list + input_latent_list[::-1]
+    
+        ############################################## inference batch by batch ##############################################
+        # The model and compositing run as overlapped stages connected by a bounded
+        # queue: batch k is blended and sent to ffmpeg while the model works on batch k+1.
+        print("start inference")
+        video_num = len(whisper_chunks)
+        batch_size = self.resolve_batch_size(args.batch_size)
+        print(f"inference batch size: {batch_size}")
+        weights = None  # per frame weight of the model's render, when skipping silence
+        closed_faces = {}  # latent cycle index -> closed-mouth face, for silence_mode "closed"
+        if args.skip_silence:
+            # Voice activity from the energy of the same 16 kHz audio Whisper sees
+            energy_db = frame_energy(audio_path, video_num, fps=fps)
+            weights = crossfade_weights(
+                speech_mask(energy_db, threshold_db=args.silence_threshold_db),
+                fade_frames=args.silence_fade_frames,
+            )
+            # The quietest frame's whisper features drive the closed-mouth renders
+            silent_chunk = whisper_chunks[int(np.argmin(energy_db))]
+            print(f"silence pass-through: {int(np.sum(weights == 0))} of {video_num} frames skip the model")
+
+        def model_batch(indices):
+            # What datagen builds for these frames
+            whisper_batch = torch.stack([whisper_chunks[i] for i in indices])
+            latent_batch = torch.cat([input_latent_list_cycle[i % len(input_latent_list_cycle)] for i in indices], dim=0)
+            return whisper_batch, latent_batch
+
+        def silence_batches():
+            # Frames the model renders go in batches of at most batch_size; runs of
+            # pass-through frames between them come as (indices, None)
+            render, rest = [], []
+            for i in range(video_num):
+                if weights[i] > 0:
+                    if rest:
+                        yield rest, None
+                        rest = []
+                    render.append(i)
+                    if len(render) == batch_size:
+                        yield render, model_batch(render)
+                        render = []
+                else:
+                    if render:
+                        yield render, model_batch(render)
+                        render = []
+                    rest.append(i)
+            if render:
+                yield render, model_batch(render)
+            if rest:
+                yield rest, None
+
+        if weights is not None:
+            batches = tqdm(silence_batches())
+        else:
+            gen = datagen(
+                whisper_chunks=whisper_chunks,
+                vae_encode_latents=input_latent_list_cycle,
+                batch_size=batch_size,
+                delay_frame=0,
+                device=device,
+            )
+            batches = ((range(i * batch_size, i * batch_size + len(batch[0])), batch)
+                       for i, batch in enumerate(tqdm(gen,total=int(np.ceil(float(video_num)/batch_size)))))
+
+        def render_closed(indices):
+            # Closed-mouth face of each latent the silent frames use, rendered once per job
+            todo = sorted({i % len(input_latent_list_cycle) for i in indices} - closed_faces.keys())
+            for k in range(0, len(todo), batch_size):
+                keys = todo[k:k + batch_size]
+                whisper_batch = silent_chunk.unsqueeze(0).expand(len(keys), -1, -1)
+                latent_batch = torch.cat([input_latent_list_cycle[l] for l in keys], dim=0)
+                if self.scheduler is not None:
+                    recon = self.scheduler.submit(whisper_batch, latent_batch).result()
+                else:
+                    recon = self.predict(whisper_batch, latent_batch)
+                closed_faces.update(zip(keys, recon))
+
+        @torch.no_grad()  # no_grad is thread-local, the decorator on inference() does not reach the stage threads
+        def run_model(item):
+            indices, batch = item
+            if args.skip_silence and args.silence_mode == "closed":
+                render_closed([i for i in indices if weights[i] < 1])
+            if batch is None:
+                return indices, None
+            whisper_batch, latent_batch = batch
+            if self.scheduler is not None:
+                # Batched together with other jobs' frames; the future is resolved in the
+                # composite stage, so this job can keep submitting in the meantime
+                return indices, self.scheduler.submit(whisper_batch, latent_batch)
+            return indices, self.predict(whisper_batch, latent_batch)
+
+        def faces(indices, recon):
+            # The generated faces to blend in; in "closed" mode silent frames use the cached
+            # closed-mouth face and the crossfade is done on the faces themselves
+            if recon is not None and self.scheduler is not None:
+                recon = recon.result()
+            if not args.skip_silence or args.silence_mode != "closed":
+                return recon
+            closed = [closed_faces[i % len(input_latent_list_cycle)] for i in indices]
+            if recon is None:
+                return closed
+            return [res if weights[i] >= 1 else
+                    np.round(weights[i] * res.astype(np.float32) + (1 - weights[i]) * face).astype(np.uint8)
+                    for i, res, face in zip(indices, recon, closed)]
+
+        def source_weight(i):
+            # Weight of the composited frame against the source frame ("source" mode crossfade)
+            return weights[i] if args.skip_silence and args.silence_mode == "source" else 1.0
+
+        ############################################## pad to full image ##############################################
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+        # Composited frames go straight into one ffmpeg process that also muxes the audio
+        writer_kwargs = dict(
+            fps=25,
+            audio_path=audio_path,
+            preset=args.video_preset,
+            crf=args.video_crf,
+            threads=args.video_threads,
+        )
+        if args.progressive:
+            # Segments land next to the playlist as soon as each window of frames is encoded
+            writer = HLSVideoWriter(output_vid_name, segment_duration=args.segment_duration, **writer_kwargs)
+        else:
+            writer = FFmpegVideoWriter(output_vid_name, **writer_kwargs)
+        watcher = HLSSegmentWatcher(output_vid_name, on_segment).start() if args.progressive and on_segment else None
+
+        def emit(i, frame):
+            if args.dump_frames:
+                cv2.imwrite(f"{result_img_save_path}/{str(i).zfill(8)}.png",frame)
+            writer.write(frame)
+
+        composite_workers = args.composite_workers
+        if composite_workers > 0 and (device.type != "cpu" or next(fp.net.parameters()).is_cuda):
+            print("Warning: compositing workers are CPU-only, compositing in-process instead")
+            composite_workers = 0
+        if composite_workers > 0 and (self.scheduler is not None or self.active_jobs > 1):
+            # Forking while another thread runs a model can leave the children with a held lock
+            print("Warning: compositing workers cannot fork while other jobs or the batching "
+                  "scheduler are running, compositing in-process instead")
+            composite_workers = 0
+
+        if composite_workers > 0:
+            # Blending runs in worker processes that write straight into shared memory;
+            # results reach the encoder in order from the composite stage itself.
+            pool = CompositorPool(
+                frame_list, coord_list, args.extra_margin, args.parsing_mode, fp,
+                num_workers=composite_workers,
+                on_frame=emit,
+            )
+
+            def composite(item):
+                indices, recon = item
+                recon = faces(indices, recon)
+                if recon is None:
+                    # Pass-through source frames go after everything already submitted
+                    pool.flush()
+                    for i in indices:
+                        emit(i, frame_list[source_index(i, len(frame_list))])
+                    return
+                for i, res_frame in zip(indices, recon):
+                    pool.submit(i, res_frame, source_weight(i))
+
+            stages = [("model", run_model), ("composite", composite)]
+        else:
+            pool = None
+            compositor = FrameCompositor(frame_list, coord_list, args.extra_margin, args.parsing_mode, fp)
+
+            def composite(item):
+                indices, recon = item
+                recon = faces(indices, recon)
+                if recon is None:
+                    # Silent frames are the source frames as they are, no blending at all
+                    for i in indices:
+                        emit(i, compositor.source_frame(i))
+                    return
+                # One batched face-parsing pass for the source frames this batch needs
+                compositor.prepare(indices)
+                for i, res_frame in zip(indices, recon):
+                    # The face is blended into the source frame itself and only its crop
+                    # region is restored after the write, so no full frame is copied;
+                    # source_weight crossfades towards the source at the edges of a silent span
+                    with compositor.blended(i, res_frame, source_weight(i)) as combine_frame:
+                        if combine_frame is None:
+                            continue
+                        emit(i, combine_frame)
+
+            stages = [("model", run_model), ("composite", composite)]
+
+        pipeline = Pipeline(stages, maxsize=args.pipeline_queue_size)
+        try:
+            with writer:
+                try:
+                    pipeline.run(batches)
+                    if pool is not None:
+                        pool.flush()
+                finally:
+                    if pool is not None:
+                        pool.close()
+        finally:
+            if watcher is not None:
+                watcher.stop()
+        print("pipeline stages:\n" + pipeline.report())
+
+        print(writer.frame_count)
+        print(f"result is save to {output_vid_name}")
+        return output_vid_name,bbox_shift_text
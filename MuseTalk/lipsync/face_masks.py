@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from musetalk.utils.blending import get_crop_box
+from lipsync.blending import get_image_mask
+
+
+def parsing_mask(fp, parsing, mode="raw"):
+    """FaceParsing's post-processing of a BiSeNet class map, as a 0/255 uint8 mask.
+
+    Same steps as FaceParsing.__call__ after the forward pass, so a mask built
+    from a batched forward pass matches the per-crop one.
+    """
+    # Add 14:neck, remove 10:nose and 7:8:9
+    if mode == "neck":
+        parsing[np.isin(parsing, [1, 11, 12, 13, 14])] = 255
+    elif mode == "jaw":
+        face_region = (np.isin(parsing, [1]) * 255).astype(np.uint8)
+        original_dilated = cv2.dilate(face_region, fp.kernel, iterations=1)
+        eroded = cv2.erode(original_dilated, fp.cheek_kernel, iterations=2)
+        face_region = cv2.bitwise_and(eroded, fp.cheek_mask)
+        face_region = cv2.bitwise_or(face_region, cv2.bitwise_and(original_dilated, ~fp.cheek_mask))
+        parsing[(face_region == 255) & (~np.isin(parsing, [10]))] = 255
+        parsing[np.isin(parsing, [11, 12, 13])] = 255
+    else:
+        parsing[np.isin(parsing, [1, 11, 12, 13])] = 255
+    parsing[parsing != 255] = 0
+    return parsing.astype(np.uint8)
+
+
+class FaceMaskCache:
+    """Face-parsing blend masks, computed in batches and reused.
+
+    The mask of a blended frame only depends on the source frame, the face box
+    and the parsing params, not on the generated mouth. Masks are keyed by
+    (source frame index, box); use one cache per FaceParsing instance and
+    parsing mode. prepare() runs BiSeNet as one batched forward pass over the
+    missing entries and post-processes each class map like FaceParsing does,
+    so masks match what get_image builds without parsing any crop twice.
+    """
+
+    def __init__(self, fp, mode, upper_boundary_ratio=0.5, expand=1.5, batch_size=8, size=(512, 512)):
+        self.fp = fp
+        self.mode = mode
+        self.upper_boundary_ratio = upper_boundary_ratio
+        self.expand = expand
+        self.batch_size = batch_size
+        self.size = size
+        self._masks = {}
+
+    def __len__(self):
+        return len(self._masks)
+
+    @torch.no_grad()
+    def prepare(self, items):
+        """Compute the masks for (src_idx, frame, box) items not cached yet."""
+        missing = {}
+        for src_idx, frame, box in items:
+            key = (src_idx, tuple(box))
+            if key not in self._masks and key not in missing:
+                missing[key] = (frame, box)
+        missing = list(missing.items())
+        device = next(self.fp.net.parameters()).device
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            images, sizes = [], []
+            for _, (frame, box) in chunk:
+                crop_box, _ = get_crop_box(box, self.expand)
+                face_large = Image.fromarray(frame[:, :, ::-1]).crop(crop_box)
+                sizes.append(face_large.size)
+                images.append(self.fp.preprocess(face_large.resize(self.size, Image.BILINEAR)))
+            out = self.fp.net(torch.stack(images).to(device))[0].cpu().numpy()
+            for k, (key, (frame, box)) in enumerate(chunk):
+                # face_seg's output: the mask scaled back to the crop size
+                seg_image = Image.fromarray(parsing_mask(self.fp, out[k].argmax(0), self.mode)).resize(sizes[k])
+                self._masks[key] = get_image_mask(frame, box, self.upper_boundary_ratio, self.expand,
+                                                  mode=self.mode, seg_image=seg_image)
+
+    def get(self, src_idx, frame, box):
+        """Return (mask_array, crop_box), parsing the frame if it is not cached."""
+        key = (src_idx, tuple(box))
+        if key not in self._masks:
+            self.prepare([(src_idx, frame, box)])
+        return self._masks[key]
@@ -0,0 +1,57 @@
+import glob
+import os
+import subprocess
+
+import cv2
+import imageio
+
+from lipsync.video_writer import ffmpeg_exe
+
+
+IMAGE_PATTERN = '*.[jpJP][pnPN]*[gG]'
+
+
+def iter_video_frames(video_path, dump_dir=None):
+    """Decode a video into BGR frames one at a time.
+
+    Frames are converted to BGR so they match what cv2.imread returned for the
+    old PNG round trip. If dump_dir is set, every frame is also written there as
+    %08d.png for debugging.
+    """
+    if dump_dir is not None:
+        os.makedirs(dump_dir, exist_ok=True)
+    reader = imageio.get_reader(video_path)
+    try:
+        for i, im in enumerate(reader):
+            if dump_dir is not None:
+                imageio.imwrite(f"{dump_dir}/{i:08d}.png", im)
+            yield cv2.cvtColor(im, cv2.COLOR_RGB2BGR)
+    finally:
+        reader.close()
+
+
+def iter_image_folder(folder):
+    """Yield BGR frames from a folder of numbered images (00000000.png, ...)."""
+    img_list = glob.glob(os.path.join(folder, IMAGE_PATTERN))
+    img_list = sorted(img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
+    for img_path in img_list:
+        yield cv2.imread(img_path)
+
+
+def resample_video_fps(video_path, output_path, fps=25, preset="veryfast", crf=18, ffmpeg_bin=None):
+    """Re-encode video_path at a constant fps with ffmpeg's fps filter.
+
+    ffmpeg drops or duplicates frames as it decodes, so no frames are held in
+    memory. The audio track is dropped, as inference muxes its own.
+    """
+    cmd = [
+        ffmpeg_bin or ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-i", video_path,
+        "-vf", f"fps={fps},pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-an",
+        "-c:v", "libx264", "-preset", preset, "-crf", str(crf),
+        "-pix_fmt", "yuv420p",
+        output_path,
+    ]
+    subprocess.run(cmd, check=True)
+    return output_path
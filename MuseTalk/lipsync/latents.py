@@ -0,0 +1,24 @@
+import numpy as np
+import torch
+
+
+@torch.no_grad()
+def get_latents_for_unet_batch(vae, crops, batch_size=16):
+    """Batched equivalent of vae.get_latents_for_unet over 256x256 BGR crops.
+
+    Each batch runs the half-masked and the full crops through a single VAE
+    encoder call, instead of two batch-1 calls per crop. Preprocessing follows
+    VAE.preprocess_img exactly, so the latents match the per-crop path up to
+    the posterior sample. Returns one [1, 8, 32, 32] tensor per crop.
+    """
+    latents = []
+    mask = vae._mask_tensor > 0.5
+    for start in range(0, len(crops), batch_size):
+        batch = np.stack(crops[start:start + batch_size])[..., ::-1]  # BGR -> RGB
+        x = torch.from_numpy(batch / 255.).float().permute(0, 3, 1, 2)
+        masked = vae.transform(x * mask)
+        ref = vae.transform(x)
+        encoded = vae.encode_latents(torch.cat([masked, ref]).to(vae.vae.device))
+        n = len(batch)
+        latents.extend(torch.cat([encoded[:n], encoded[n:]], dim=1).split(1))
+    return latents
@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import onnxruntime as ort
+import torch
+
+
+ONNX_FILES = {
+    "pe": "pe/pe.onnx",
+    # the UNet is over 2 GB, its weights go to external data files next to it
+    "unet": "unet/unet.onnx",
+    "vae_decoder": "vae_decoder/vae_decoder.onnx",
+    # written by quantize_int8.py, used instead of "unet" with quantize="int8"
+    "unet_int8": "unet_int8/unet_int8.onnx",
+}
+
+
+class _UNetSample(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, latents, timesteps, encoder_hidden_states):
+        return self.unet(latents, timesteps, encoder_hidden_states=encoder_hidden_states).sample
+
+
+class _VaeDecoder(torch.nn.Module):
+    """vae.decode_latents up to the uint8 conversion, which stays in numpy."""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae.vae
+        self.scaling_factor = vae.scaling_factor
+
+    def forward(self, latents):
+        image = self.vae.decode(latents / self.scaling_factor).sample
+        return (image / 2 + 0.5).clamp(0, 1)
+
+
+def _export(module, args, onnx_dir, name, input_names, output_names, opset):
+    path = os.path.join(onnx_dir, ONNX_FILES[name])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dynamic_axes = {n: {0: "batch"} for n in input_names + output_names if n != "timesteps"}
+    torch.onnx.export(
+        module, args, path,
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    print(f"exported {name} to {path}")
+
+
+@torch.no_grad()
+def export_onnx(pe, unet, vae, onnx_dir, opset=17):
+    """Export pe, the UNet and the VAE decoder from load_all_model to onnx_dir.
+
+    The models must be float32 on the CPU. All graphs take a dynamic batch
+    dimension, so any inference batch size can run on them. The VAE encoder
+    is not exported: latents are computed once per avatar and cached.
+    """
+    whisper = torch.randn(2, 50, 384)
+    latents = torch.randn(2, 8, 32, 32)
+    timesteps = torch.tensor([0])
+    _export(pe, (whisper,), onnx_dir, "pe", ["whisper"], ["audio_feature"], opset)
+    _export(_UNetSample(unet.model), (latents, timesteps, pe(whisper)), onnx_dir, "unet",
+            ["latents", "timesteps", "encoder_hidden_states"], ["pred_latents"], opset)
+    _export(_VaeDecoder(vae), (torch.randn(2, 4, 32, 32),), onnx_dir, "vae_decoder",
+            ["pred_latents"], ["image"], opset)
+
+
+def _numpy(x):
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().float().numpy()
+    return np.ascontiguousarray(x, dtype=np.float32)
+
+
+class OnnxRuntimeModels:
+    """pe -> UNet -> VAE decoder on ONNX Runtime's CPU provider.
+
+    Sessions are built with all graph optimizations enabled. Each model runs
+    through IO binding and its output stays an OrtValue that is bound straight
+    to the next model's input, so intermediate tensors are never copied back
+    to numpy between the three graphs. With quantize="int8" the statically
+    quantized UNet is used.
+    """
+
+    def __init__(self, onnx_dir, num_threads=0, quantize=None):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads  # 0 lets ORT pick
+        files = {
+            "pe": ONNX_FILES["pe"],
+            "unet": ONNX_FILES["unet_int8" if quantize == "int8" else "unet"],
+            "vae_decoder": ONNX_FILES["vae_decoder"],
+        }
+        self.sessions = {}
+        for name, rel_path in files.items():
+            path = os.path.join(onnx_dir, rel_path)
+            if not os.path.exists(path):
+                script = "quantize_int8.py" if name == "unet" and quantize else "export_onnx.py"
+                raise FileNotFoundError(f"{path} not found, run {script} first")
+            self.sessions[name] = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._timesteps = ort.OrtValue.ortvalue_from_numpy(np.zeros(1, dtype=np.int64))
+
+    def _run(self, name, inputs):
+        session = self.sessions[name]
+        binding = session.io_binding()
+        for input_name, value in inputs.items():
+            if isinstance(value, ort.OrtValue):
+                binding.bind_ortvalue_input(input_name, value)
+            else:
+                binding.bind_cpu_input(input_name, _numpy(value))
+        binding.bind_output(session.get_outputs()[0].name, "cpu")
+        session.run_with_iobinding(binding)
+        return binding.get_outputs()[0]
+
+    def predict_latents(self, whisper_batch, latent_batch):
+        """UNet output for one batch, as an OrtValue."""
+        audio_feature = self._run("pe", {"whisper": whisper_batch})
+        return self._run("unet", {
+            "latents": latent_batch,
+            "timesteps": self._timesteps,
+            "encoder_hidden_states": audio_feature,
+        })
+
+    def predict(self, whisper_batch, latent_batch):
+        """Same output as vae.decode_latents on the UNet output: BGR uint8, [B, 256, 256, 3]."""
+        image = self._run("vae_decoder", {"pred_latents": self.predict_latents(whisper_batch, latent_batch)}).numpy()
+        image = (image.transpose(0, 2, 3, 1) * 255).round().astype(np.uint8)
+        return image[..., ::-1]
+
+
+@torch.no_grad()
+def compare_with_torch(models, pe, unet, vae, batch_size=4, seed=0):
+    """Max abs difference between the torch and ONNX Runtime paths on random inputs.
+
+    Returns the difference of the UNet output latents and of the decoded
+    uint8 crops. The torch models must be float32 on the CPU.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    whisper_batch = torch.randn(batch_size, 50, 384, generator=generator)
+    latent_batch = torch.randn(batch_size, 8, 32, 32, generator=generator)
+
+    pred_latents = unet.model(latent_batch, torch.tensor([0]), encoder_hidden_states=pe(whisper_batch)).sample
+    image = vae.decode_latents(pred_latents)
+
+    ort_latents = models.predict_latents(whisper_batch, latent_batch).numpy()
+    ort_image = models.predict(whisper_batch, latent_batch)
+    return {
+        "latents_max_abs": float(np.abs(pred_latents.numpy() - ort_latents).max()),
+        "image_max_abs": int(np.abs(image.astype(np.int16) - ort_image.astype(np.int16)).max()),
+    }
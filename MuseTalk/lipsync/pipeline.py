@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.items = 0
+        self.busy = 0.0
+        self.occupancy_sum = 0
+
+    def report(self):
+        avg = self.occupancy_sum / self.items if self.items else 0.0
+        return f"{self.name}: {self.items} items, busy {self.busy:.2f}s, input queue avg {avg:.1f}/{self.maxsize}"
+
+
+class Pipeline:
+    """Run items through a chain of stages, one thread per stage.
+
+    Stages are connected by bounded queues, so stage k can work on item n while
+    stage k+1 is still busy with item n-1, and a slow stage applies back
+    pressure instead of letting results pile up in memory. Each stage is a
+    (name, fn) pair; fn takes one item and returns the item for the next stage.
+    The last stage's return value is dropped.
+
+    Per-stage input queue occupancy is sampled on every item: a stage whose
+    input queue stays near full is the bottleneck.
+    """
+
+    def __init__(self, stages, maxsize=4):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.stats = [StageStats(name, maxsize) for name, _ in stages]
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _feed(self, source, out_q):
+        try:
+            for item in source:
+                if not self._put(out_q, item):
+                    return
+            self._put(out_q, _DONE)
+        except Exception as e:
+            self._fail(e)
+
+    def _work(self, fn, stats, in_q, out_q):
+        try:
+            while True:
+                stats.occupancy_sum += in_q.qsize()
+                item = self._get(in_q)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                result = fn(item)
+                stats.busy += time.perf_counter() - start
+                stats.items += 1
+                if out_q is not None and not self._put(out_q, result):
+                    return
+            if out_q is not None:
+                self._put(out_q, _DONE)
+        except Exception as e:
+            self._fail(e)
+
+    def run(self, source):
+        """Consume source through all stages; re-raises the first stage error."""
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0]), daemon=True)]
+        for k, ((name, fn), stats) in enumerate(zip(self.stages, self.stats)):
+            out_q = queues[k + 1] if k + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._work, args=(fn, stats, queues[k], out_q), name=name, daemon=True))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+    def report(self):
+        return "\n".join(stats.report() for stats in self.stats)
@@ -0,0 +1,24 @@
+import torch
+
+
+PRECISIONS = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+def _to_float32(module, args):
+    return tuple(a.float() if torch.is_tensor(a) and a.is_floating_point() else a for a in args)
+
+
+def keep_float32(module):
+    """Run module in float32 inside a model that was cast to a lower precision.
+
+    The module's weights are upcast and a forward pre-hook casts its inputs,
+    so layers that are unsafe in bf16 or fp16 fall back one by one while the
+    rest of the model stays in the lower precision.
+    """
+    module.float()
+    module.register_forward_pre_hook(_to_float32)
+    return module
@@ -0,0 +1,217 @@
+import gc
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+
+
+def process_memory(pid):
+    """RSS, PSS and shared bytes of process pid, from /proc/<pid>/smaps_rollup (Linux).
+
+    RSS counts shared pages in full in every process that maps them; PSS splits
+    them between those processes, so the PSS of a pool adds up to its real
+    footprint.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":"):
+                fields[parts[0][:-1]] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def _collect_modules(obj, depth=2):
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    if obj is None or depth == 0 or not hasattr(obj, "__dict__"):
+        return []
+    return [m for value in vars(obj).values() for m in _collect_modules(value, depth - 1)]
+
+
+def _shared_modules(engine):
+    """Models the workers inherit: pe, UNet, VAE, Whisper, DWPose, the face detector and BiSeNet."""
+    from musetalk.utils import preprocessing  # loads DWPose and the face detector
+    objs = [engine.pe, engine.unet.model, engine.vae.vae, engine.whisper,
+            preprocessing.model, preprocessing.fa, engine.face_parser().net]
+    return [m for obj in objs for m in _collect_modules(obj)]
+
+
+def _serve(engine, jobs, results, num_threads):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    engine.warmup()
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, args, kwargs = job
+        # Lets the parent fail this job if the worker dies while running it
+        results.put(("start", job_id, os.getpid()))
+        try:
+            results.put(("done", job_id, (engine.inference(*args, **kwargs), None)))
+        except Exception as e:
+            results.put(("done", job_id, (None, f"{type(e).__name__}: {e}")))
+
+
+class PreforkWorkerPool:
+    """Serve inference() jobs from forked worker processes sharing one copy of the models.
+
+    The parent loads the engine, DWPose, the face detector and BiSeNet before
+    forking num_workers processes. The workers then serve jobs concurrently
+    from the parent's copy-on-write pages instead of each loading its own
+    copy; the weights are only read, so those pages stay shared. The GC is
+    frozen before the fork
+    so collections in the workers do not touch, and thereby copy, the pages
+    of objects inherited from the parent. Job arguments and results are
+    pickled, so callbacks such as on_segment are not supported.
+
+    Forked children cannot use the parent's CUDA context, and ONNX Runtime's
+    thread pools do not survive a fork, so this is for CPU engines on the
+    torch backend. If a worker dies (e.g. OOM-killed), the job it was running
+    fails with RuntimeError; once no worker is left every pending job does.
+    memory_report() gives RSS and PSS per worker and in total.
+
+    Usage:
+        pool = PreforkWorkerPool(InferenceEngine(device="cpu"), num_workers=4).start()
+        output_path, bbox_shift_text = pool.inference(audio_path, video_path, 0)
+        print(pool.report())
+    """
+
+    def __init__(self, engine, num_workers, threads_per_worker=None):
+        self.engine = engine
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self._ids = itertools.count()
+        self._futures = {}
+        self._running = {}  # job id -> pid of the worker running it
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        self.engine.load()
+        if self.engine.device.type != "cpu":
+            raise RuntimeError("Pre-forked workers are CPU-only, a forked child cannot use the parent's CUDA context")
+        if self.engine.scheduler is not None:
+            raise RuntimeError("The micro-batching scheduler's thread does not survive a fork, start the pool without it")
+        if self.engine.ort is not None:
+            raise RuntimeError("ONNX Runtime sessions are not fork-safe, use the torch backend with pre-forked workers")
+        modules = _shared_modules(self.engine)
+        # DWPose, the face detector and BiSeNet pick CUDA on their own when it is available
+        if any(t.is_cuda for m in modules for t in itertools.chain(m.parameters(), m.buffers())) \
+                or torch.cuda.is_initialized():
+            raise RuntimeError("CUDA is initialized in the parent, forked workers cannot use it; "
+                               "hide the GPU (CUDA_VISIBLE_DEVICES=) to run pre-forked workers")
+        # Tensor storage is never touched by refcounting, so the fork's copy-on-write
+        # pages stay shared; share_memory() would copy several GB into /dev/shm instead,
+        # which is 64 MB by default under Docker
+        gc.collect()
+        gc.freeze()
+
+        ctx = mp.get_context("fork")
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        # Not daemonic: workers may fork compositing processes of their own
+        self._workers = [
+            ctx.Process(target=_serve, args=(self.engine, self._jobs, self._results, self.threads_per_worker))
+            for _ in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def _collect(self):
+        while True:
+            try:
+                item = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if item is None:
+                return
+            kind, job_id, payload = item
+            with self._lock:
+                if kind == "start":
+                    self._running[job_id] = payload
+                    continue
+                self._running.pop(job_id, None)
+                future = self._futures.pop(job_id, None)
+            if future is None:  # already failed by _check_workers
+                continue
+            result, error = payload
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _check_workers(self):
+        """Fail the jobs of workers that died, and every pending job once none is left."""
+        dead = {w.pid: w.exitcode for w in self._workers if not w.is_alive()}
+        if not dead:
+            return
+        with self._lock:
+            if len(dead) == len(self._workers):
+                failed = list(self._futures)
+            else:
+                failed = [job_id for job_id, pid in self._running.items() if pid in dead]
+            futures = [(job_id, self._futures.pop(job_id, None), self._running.pop(job_id, None))
+                       for job_id in failed]
+        for job_id, future, pid in futures:
+            if future is not None:
+                reason = f"worker {pid} exited with code {dead[pid]}" if pid in dead else "no worker is left"
+                future.set_exception(RuntimeError(f"Job {job_id} failed, {reason}"))
+
+    def submit(self, *args, **kwargs):
+        """Queue one inference(*args, **kwargs) job; returns a Future of its result."""
+        job_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._futures[job_id] = future
+        self._jobs.put((job_id, args, kwargs))
+        return future
+
+    def inference(self, *args, **kwargs):
+        return self.submit(*args, **kwargs).result()
+
+    def memory_report(self):
+        parent = process_memory(os.getpid())
+        workers = [dict(pid=w.pid, **process_memory(w.pid)) for w in self._workers if w.is_alive()]
+        return {
+            "parent": parent,
+            "workers": workers,
+            "total_rss": parent["rss"] + sum(w["rss"] for w in workers),
+            "total_pss": parent["pss"] + sum(w["pss"] for w in workers),
+        }
+
+    def report(self):
+        mb = 1024 ** 2
+        m = self.memory_report()
+        lines = [f"parent: RSS {m['parent']['rss'] / mb:.0f} MB, PSS {m['parent']['pss'] / mb:.0f} MB"]
+        for w in m["workers"]:
+            lines.append(f"worker {w['pid']}: RSS {w['rss'] / mb:.0f} MB, PSS {w['pss'] / mb:.0f} MB, "
+                         f"shared {w['shared'] / mb:.0f} MB")
+        lines.append(f"total: RSS {m['total_rss'] / mb:.0f} MB (shared pages counted per process), "
+                     f"PSS {m['total_pss'] / mb:.0f} MB")
+        return "\n".join(lines)
+
+    def close(self, timeout=30):
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._results.put(None)
+        self._collector.join()
+        self._workers = []
@@ -0,0 +1,226 @@
+import cv2
+import numpy as np
+import torch
+from mmengine.dataset import Compose, pseudo_collate
+from mmengine.registry import init_default_scope
+from tqdm import tqdm
+
+# The DWPose model and face detector are created when the upstream module is
+# imported; reuse them instead of loading a second copy.
+from musetalk.utils.preprocessing import model, fa, coord_placeholder
+
+
+_pose_pipeline = None
+
+
+def get_face_landmarks_batch(frames):
+    """The 68 face landmarks (int32) of each BGR frame, from one DWPose forward pass.
+
+    Builds the same inputs as mmpose's inference_topdown with no person boxes
+    (the whole frame), for all frames at once, and runs them through a single
+    test_step.
+    """
+    global _pose_pipeline
+    init_default_scope(model.cfg.get('default_scope', 'mmpose'))
+    if _pose_pipeline is None:
+        _pose_pipeline = Compose(model.cfg.test_dataloader.dataset.pipeline)
+    data_list = []
+    for frame in frames:
+        h, w = frame.shape[:2]
+        data_info = dict(img=frame, bbox=np.array([[0, 0, w, h]], dtype=np.float32),
+                         bbox_score=np.ones(1, dtype=np.float32))
+        data_info.update(model.dataset_meta)
+        data_list.append(_pose_pipeline(data_info))
+    with torch.no_grad():
+        results = model.test_step(pseudo_collate(data_list))
+    return [r.pred_instances.keypoints[0][23:91].astype(np.int32) for r in results]
+
+
+def _batches(frames, batch_size):
+    """Consecutive runs of at most batch_size frames of the same size (the detector needs one size per batch)."""
+    batch = []
+    for frame in frames:
+        if batch and (len(batch) == batch_size or frame.shape != batch[0].shape):
+            yield batch
+            batch = []
+        batch.append(frame)
+    if batch:
+        yield batch
+
+
+def _detect(frames, upperbondrange, batch_size):
+    """Boxes, raw landmarks and the per-face bbox_shift ranges in one detection pass."""
+    coords_list, landmarks, range_minus, range_plus = [], [], [], []
+    with tqdm(total=len(frames)) as progress:
+        for batch in _batches(frames, batch_size):
+            face_land_marks = get_face_landmarks_batch(batch)
+            bboxes = fa.get_detections_for_batch(np.asarray(batch))
+            for face_land_mark, f in zip(face_land_marks, bboxes):
+                if f is None:  # no face in the image
+                    coords_list.append(coord_placeholder)
+                    landmarks.append(None)
+                    continue
+                landmarks.append(face_land_mark.copy())
+
+                # adjust the bounding box refer to landmark, exactly as upstream (which
+                # shifts landmark 29 in place before measuring the half face)
+                half_face_coord = face_land_mark[29]
+                range_minus.append((face_land_mark[30] - face_land_mark[29])[1])
+                range_plus.append((face_land_mark[29] - face_land_mark[28])[1])
+                if upperbondrange != 0:
+                    half_face_coord[1] = upperbondrange + half_face_coord[1]
+                half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
+                min_upper_bond = 0
+                upper_bond = max(min_upper_bond, half_face_coord[1] - half_face_dist)
+
+                f_landmark = (np.min(face_land_mark[:, 0]), int(upper_bond), np.max(face_land_mark[:, 0]), np.max(face_land_mark[:, 1]))
+                x1, y1, x2, y2 = f_landmark
+
+                if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
+                    coords_list.append(f)
+                    print("error bbox:", f)
+                else:
+                    coords_list.append(f_landmark)
+            progress.update(len(batch))
+    return coords_list, landmarks, range_minus, range_plus
+
+
+def _range_text(num_frames, range_minus, range_plus, upperbondrange):
+    if not range_minus:
+        return f"Total frame:「{num_frames}」 No face detected, the current value: {upperbondrange}"
+    return f"Total frame:「{num_frames}」 Manually adjust range : [ -{int(sum(range_minus) / len(range_minus))}~{int(sum(range_plus) / len(range_plus))} ] , the current value: {upperbondrange}"
+
+
+def bbox_range_text(landmarks, upperbondrange=0):
+    """The bbox_shift range text for frames with these raw landmarks (None where none were detected).
+
+    Gives the same text as the detection pass that produced the landmarks, so
+    it can be rebuilt for any prefix of the frames.
+    """
+    detected = [m for m in landmarks if m is not None]
+    range_minus = [(m[30] - m[29])[1] for m in detected]
+    range_plus = [(m[29] - m[28])[1] for m in detected]
+    return _range_text(len(landmarks), range_minus, range_plus, upperbondrange)
+
+
+def get_landmarks_and_bboxes(frames, upperbondrange=0, batch_size=8):
+    """One landmark pass over decoded BGR frames.
+
+    Frames go through the face detector and DWPose batch_size at a time; both
+    run on full-resolution frames, so lower it for large inputs on a small GPU.
+    Returns the face boxes (same logic as upstream get_landmark_and_bbox), the
+    raw 68-point landmarks (None where no face was found) and the bbox_shift
+    range text that get_bbox_range used to compute with a second pass.
+    """
+    if upperbondrange != 0:
+        print('get key_landmark and face bounding boxes with the bbox_shift:', upperbondrange)
+    else:
+        print('get key_landmark and face bounding boxes with the default value')
+    coords_list, landmarks, range_minus, range_plus = _detect(frames, upperbondrange, batch_size)
+    range_text = _range_text(len(frames), range_minus, range_plus, upperbondrange)
+    if range_minus:
+        print("********************************************bbox_shift parameter adjustment**********************************************************")
+        print(range_text)
+        print("*************************************************************************************************************************************")
+    return coords_list, landmarks, range_text
+
+
+def get_landmark_and_bbox_from_frames(frames, upperbondrange=0, batch_size=8):
+    """In-memory version of musetalk.utils.preprocessing.get_landmark_and_bbox.
+
+    Takes decoded BGR frames instead of image paths so callers do not need to
+    write frames to disk first. The bbox logic matches upstream exactly.
+    """
+    coords_list, _, _ = get_landmarks_and_bboxes(frames, upperbondrange, batch_size)
+    return coords_list, frames
+
+
+def _thumbnail(frame, size=64):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def _bbox_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def select_keyframes(frames, stride, motion_threshold):
+    """Pick the frames to run full detection on.
+
+    The first and last frames and every stride-th frame are keyframes. A frame
+    also becomes a keyframe when the mean absolute difference of its 64x64
+    grayscale thumbnail against the previous keyframe exceeds motion_threshold
+    (0-255 scale), which catches fast head motion and scene cuts.
+
+    Apart from the last frame, keyframes only depend on earlier frames. When
+    the last frame is a stride-th one too, the boxes are therefore the same as
+    on the same frames of any longer run, see aligned_frame_count.
+    """
+    keyframes = []
+    ref = None
+    for i, frame in enumerate(frames):
+        thumb = _thumbnail(frame)
+        if ref is None or i % stride == 0 or i == len(frames) - 1 \
+                or np.mean(np.abs(thumb - ref)) > motion_threshold:
+            keyframes.append(i)
+            ref = thumb
+    return keyframes
+
+
+def aligned_frame_count(num_frames, stride):
+    """Frames to detect on so that the boxes of the first num_frames do not depend on where the run ends.
+
+    Frames past the last stride-th keyframe are interpolated towards the
+    forced final keyframe, so runs of different lengths disagree there. Running
+    up to the next stride-th frame makes the first num_frames boxes a prefix of
+    every longer run's (such as a cached one).
+    """
+    if stride <= 1 or num_frames <= 1:
+        return num_frames
+    return -(-(num_frames - 1) // stride) * stride + 1
+
+
+def get_landmark_and_bbox_keyframes(frames, upperbondrange=0, stride=5, motion_threshold=8.0, min_iou=0.6,
+                                    batch_size=8):
+    """Like get_landmarks_and_bboxes, but only detects on keyframes.
+
+    Boxes of the frames between two keyframes are linearly interpolated. When
+    the two keyframe boxes overlap less than min_iou, or either keyframe has
+    no face, interpolation is not trusted and every frame in between gets a
+    full detection instead. Interpolated frames have no landmarks (None), and
+    the range text is averaged over the detected frames.
+    """
+    if stride <= 1:
+        return get_landmarks_and_bboxes(frames, upperbondrange, batch_size)
+
+    keyframes = select_keyframes(frames, stride, motion_threshold)
+    print(f"detecting landmarks on {len(keyframes)} of {len(frames)} keyframes (stride {stride})")
+    coords, marks, range_minus, range_plus = _detect([frames[i] for i in keyframes], upperbondrange, batch_size)
+    coords_list = [None] * len(frames)
+    landmarks = [None] * len(frames)
+    for i, coord, mark in zip(keyframes, coords, marks):
+        coords_list[i] = coord
+        landmarks[i] = mark
+
+    for k0, k1 in zip(keyframes[:-1], keyframes[1:]):
+        if k1 - k0 <= 1:
+            continue
+        box0, box1 = coords_list[k0], coords_list[k1]
+        if box0 == coord_placeholder or box1 == coord_placeholder or _bbox_iou(box0, box1) < min_iou:
+            # Tracking confidence too low, fall back to a full detection
+            gap, gap_marks, gap_minus, gap_plus = _detect(frames[k0 + 1:k1], upperbondrange, batch_size)
+            coords_list[k0 + 1:k1] = gap
+            landmarks[k0 + 1:k1] = gap_marks
+            range_minus += gap_minus
+            range_plus += gap_plus
+            continue
+        box0 = np.asarray(box0, dtype=np.float64)
+        box1 = np.asarray(box1, dtype=np.float64)
+        for i in range(k0 + 1, k1):
+            t = (i - k0) / (k1 - k0)
+            coords_list[i] = tuple(int(round(v)) for v in box0 + (box1 - box0) * t)
+    return coords_list, landmarks, _range_text(len(frames), range_minus, range_plus, upperbondrange)
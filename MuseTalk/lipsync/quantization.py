@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import torch
+
+from lipsync.frames import iter_video_frames
+
+
+def quantize_dynamic_int8(module):
+    """Dynamic int8 quantization of the Linear layers of module, in place (CPU only).
+
+    Weights are stored as int8 and activations are quantized per batch, so no
+    calibration is needed. PyTorch has no dynamic kernels for convolutions;
+    for those use the static ONNX path (quantize_onnx_unet).
+    """
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+@torch.no_grad()
+def collect_calibration_batches(engine, audio_path, video_path, max_batches=16, **inference_kwargs):
+    """UNet inputs seen while engine renders a reference clip, for static quantization.
+
+    engine must be a float32 engine on the torch backend. Returns up to
+    max_batches dicts of numpy arrays keyed by the UNet graph's input names.
+    """
+    batches = []
+    predict = engine.predict
+
+    def recording_predict(whisper_batch, latent_batch):
+        if len(batches) < max_batches:
+            batches.append({
+                "latents": latent_batch.float().cpu().numpy(),
+                "timesteps": np.zeros(1, dtype=np.int64),
+                "encoder_hidden_states": engine.pe(whisper_batch).float().cpu().numpy(),
+            })
+        return predict(whisper_batch, latent_batch)
+
+    engine.predict = recording_predict
+    try:
+        engine.inference(audio_path, video_path, 0, **inference_kwargs)
+    finally:
+        del engine.predict
+    return batches
+
+
+def quantize_onnx_unet(onnx_dir, calibration_batches, per_channel=True):
+    """Static int8 (QDQ) quantization of the exported UNet graph.
+
+    Activation ranges come from calibration_batches, see
+    collect_calibration_batches. Convolutions and MatMuls are both quantized.
+    The result is written next to the float graph and picked up by
+    OnnxRuntimeModels(..., quantize="int8").
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from lipsync.onnx_backend import ONNX_FILES
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter(calibration_batches)
+
+        def get_next(self):
+            return next(self._batches, None)
+
+    output_path = os.path.join(onnx_dir, ONNX_FILES["unet_int8"])
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    quantize_static(
+        os.path.join(onnx_dir, ONNX_FILES["unet"]),
+        output_path,
+        _Reader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=per_channel,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        use_external_data_format=True,
+    )
+    print(f"wrote quantized UNet to {output_path}")
+    return output_path
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def video_psnr(reference_path, test_path):
+    """Mean per-frame PSNR of test_path against reference_path."""
+    values = [psnr(a, b) for a, b in zip(iter_video_frames(reference_path), iter_video_frames(test_path))]
+    return float(np.mean(values))
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+
+_STOP = object()
+
+
+class _Request:
+    def __init__(self, whisper_batch, latent_batch):
+        self.whisper_batch = whisper_batch
+        self.latent_batch = latent_batch
+        self.size = len(whisper_batch)
+        self.next = 0  # first frame not yet put in a batch
+        self.results = []
+        self.done = 0
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """Pack model work from concurrent jobs into full batches.
+
+    Jobs call submit(whisper_batch, latent_batch) with any number of frames
+    and get a Future of the decoded crops for those frames, in order. One
+    worker thread takes frames from all pending requests, oldest first. It
+    runs predict(whisper_batch, latent_batch) once batch_size frames are
+    collected, or once the oldest waiting frame has waited max_wait seconds,
+    so a lone job is never held back for long. Requests larger than a batch
+    are split, and small ones (e.g. the last batch of a job) share a batch
+    with other jobs' frames.
+
+    Usage:
+        with MicroBatchScheduler(engine.predict, batch_size=16) as scheduler:
+            recon = scheduler.submit(whisper_batch, latent_batch).result()
+    """
+
+    def __init__(self, predict, batch_size=16, max_wait=0.02):
+        self.predict = predict
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._pending = deque()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._frames = 0
+        self._busy = 0.0
+        self._latencies = []
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def submit(self, whisper_batch, latent_batch):
+        request = _Request(whisper_batch, latent_batch)
+        if request.size == 0:
+            request.future.set_result(np.empty((0, 256, 256, 3), dtype=np.uint8))
+        else:
+            self._queue.put(request)
+        return request.future
+
+    def _next_batch(self):
+        """Up to batch_size frames as (request, start, end) slices, oldest request first."""
+        slices, n, deadline = [], 0, None
+        while n < self.batch_size:
+            if not self._pending:
+                if self._stopping:
+                    break
+                timeout = None if deadline is None else deadline - time.perf_counter()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    self._stopping = True
+                    break
+                self._pending.append(request)
+            request = self._pending[0]
+            if deadline is None:
+                deadline = request.submitted + self.max_wait
+            take = min(self.batch_size - n, request.size - request.next)
+            slices.append((request, request.next, request.next + take))
+            request.next += take
+            n += take
+            if request.next == request.size:
+                self._pending.popleft()
+        return slices
+
+    def _run_batch(self, slices):
+        whisper_batch = torch.cat([r.whisper_batch[s:e] for r, s, e in slices])
+        latent_batch = torch.cat([r.latent_batch[s:e] for r, s, e in slices])
+        start = time.perf_counter()
+        try:
+            recon = self.predict(whisper_batch, latent_batch)
+        except Exception as e:
+            for r, _, _ in slices:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._frames += len(whisper_batch)
+            self._busy += now - start
+
+        offset = 0
+        for r, s, e in slices:
+            r.results.append(recon[offset:offset + e - s])
+            offset += e - s
+            r.done += e - s
+            if r.done == r.size and not r.future.done():
+                r.future.set_result(np.concatenate(r.results))
+                with self._lock:
+                    self._latencies.append(now - r.submitted)
+
+    @torch.no_grad()  # no_grad is thread-local
+    def _run(self):
+        while True:
+            slices = self._next_batch()
+            if slices:
+                self._run_batch(slices)
+            if self._stopping and not self._pending:
+                return
+
+    def metrics(self):
+        with self._lock:
+            latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            return {
+                "batches": self._batches,
+                "frames": self._frames,
+                "requests": len(self._latencies),
+                "mean_batch_fill": self._frames / (self._batches * self.batch_size) if self._batches else 0.0,
+                "frames_per_s": self._frames / elapsed if elapsed else 0.0,
+                "busy_frames_per_s": self._frames / self._busy if self._busy else 0.0,
+                "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p95": float(np.percentile(latencies, 95)),
+            }
+
+    def report(self):
+        m = self.metrics()
+        return (f"{m['frames']} frames in {m['batches']} batches (fill {m['mean_batch_fill']:.0%}), "
+                f"{m['frames_per_s']:.1f} frames/s wall, {m['busy_frames_per_s']:.1f} frames/s busy, "
+                f"request latency p50 {m['latency_p50'] * 1000:.0f} ms, p95 {m['latency_p95'] * 1000:.0f} ms")
@@ -0,0 +1,66 @@
+import librosa
+import numpy as np
+
+
+def frame_energy(audio_path, num_frames, fps=25, sr=16000):
+    """Loudness of the audio under each video frame, in dB relative to the loudest frame.
+
+    The audio is loaded like AudioProcessor.get_audio_feature does (librosa,
+    16 kHz mono), so frame i covers the same samples as whisper chunk i.
+    Frames past the end of the audio are -inf.
+    """
+    audio, _ = librosa.load(audio_path, sr=sr)
+    hop = sr / fps
+    rms = np.zeros(num_frames, dtype=np.float64)
+    for i in range(num_frames):
+        window = audio[int(i * hop):int((i + 1) * hop)]
+        if len(window):
+            rms[i] = np.sqrt(np.mean(np.square(window, dtype=np.float64)))
+    with np.errstate(divide="ignore"):
+        return 20 * np.log10(rms / max(rms.max(), 1e-8))
+
+
+def speech_mask(energy_db, threshold_db=-40.0, min_silence=10, pad=3):
+    """Per frame, True where there is speech.
+
+    A frame is speech when its energy is above threshold_db. Speech is then
+    widened by pad frames on both sides, since the mouth opens slightly before
+    a sound and Whisper sees a few frames of context, and silences shorter
+    than min_silence frames (pauses between words) count as speech.
+    """
+    speech = energy_db > threshold_db
+    if pad > 0:
+        kernel = np.ones(2 * pad + 1)
+        speech = np.convolve(speech, kernel, mode="same") > 0
+    start = None
+    for i in range(len(speech) + 1):
+        if i < len(speech) and not speech[i]:
+            if start is None:
+                start = i
+        elif start is not None:
+            # Leading and trailing silence are kept however short
+            if i - start < min_silence and start > 0 and i < len(speech):
+                speech[start:i] = True
+            start = None
+    return speech
+
+
+def crossfade_weights(speech, fade_frames=3):
+    """Weight of the model's render per frame: 1 on speech, 0 deep in silence.
+
+    The first and last fade_frames of every silent span ramp linearly between
+    the two, so the render fades into the pass-through frame and back.
+    """
+    n = len(speech)
+    distance = np.full(n, np.inf)
+    last = -np.inf
+    for i in range(n):
+        if speech[i]:
+            last = i
+        distance[i] = i - last
+    last = np.inf
+    for i in reversed(range(n)):
+        if speech[i]:
+            last = i
+        distance[i] = min(distance[i], last - i)
+    return np.clip(1 - distance / (fade_frames + 1), 0, 1)
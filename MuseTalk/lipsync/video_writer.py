@@ -0,0 +1,183 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+
+def ffmpeg_exe():
+    """ffmpeg on PATH, else the binary bundled with imageio[ffmpeg]."""
+    path = shutil.which("ffmpeg")
+    if path is None:
+        import imageio_ffmpeg
+        path = imageio_ffmpeg.get_ffmpeg_exe()
+    return path
+
+
+class FFmpegVideoWriter:
+    """Pipe raw BGR frames into a single ffmpeg process.
+
+    The video is encoded once with libx264 and, if audio_path is given, the
+    audio track is muxed in the same pass. The ffmpeg process is started on the
+    first frame, once the frame size is known.
+
+    Usage:
+        with FFmpegVideoWriter(output_path, fps=25, audio_path=audio_path) as writer:
+            for frame in frames:
+                writer.write(frame)
+    """
+
+    def __init__(self, output_path, fps=25, audio_path=None, preset="medium", crf=18, threads=0,
+                 ffmpeg_bin=None):
+        self.output_path = output_path
+        self.fps = fps
+        self.audio_path = audio_path
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.ffmpeg_bin = ffmpeg_bin or ffmpeg_exe()
+        self.frame_size = None
+        self.frame_count = 0
+        self._proc = None
+
+    def _build_cmd(self, width, height):
+        cmd = [
+            self.ffmpeg_bin, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(self.fps),
+            "-i", "-",
+        ]
+        if self.audio_path is not None:
+            cmd += ["-i", self.audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+        cmd += [
+            "-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf),
+            "-threads", str(self.threads),
+            # yuv420p needs even dimensions
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-pix_fmt", "yuv420p",
+        ]
+        if self.audio_path is not None:
+            cmd += ["-c:a", "aac", "-shortest"]
+        cmd += self._output_args()
+        return cmd
+
+    def _output_args(self):
+        return [self.output_path]
+
+    def _open(self, width, height):
+        self.frame_size = (width, height)
+        self._proc = subprocess.Popen(self._build_cmd(width, height), stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        height, width = frame.shape[:2]
+        if self._proc is None:
+            self._open(width, height)
+        elif (width, height) != self.frame_size:
+            raise ValueError(f"Frame size {width}x{height} does not match stream size {self.frame_size[0]}x{self.frame_size[1]}")
+        # Straight from the array's buffer, tobytes() would copy the whole frame first
+        self._proc.stdin.write(frame.data if frame.flags.c_contiguous else frame.tobytes())
+        self.frame_count += 1
+
+    def close(self):
+        if self._proc is None:
+            return
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        self._proc = None
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {returncode} while writing {self.output_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+            return False
+        self.close()
+        return False
+
+
+class HLSVideoWriter(FFmpegVideoWriter):
+    """FFmpegVideoWriter that emits an HLS event playlist of fMP4 segments.
+
+    output_path is the playlist (e.g. out_dir/index.m3u8); init.mp4 and the
+    segment_%05d.m4s files are written next to it. ffmpeg finishes each segment
+    as soon as segment_duration seconds of frames have been written and then
+    lists it in the playlist, so playback can start while rendering goes on.
+    Keyframes are forced on segment boundaries so every segment is decodable.
+    """
+
+    def __init__(self, output_path, segment_duration=2.0, **kwargs):
+        super().__init__(output_path, **kwargs)
+        self.segment_duration = segment_duration
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    def _output_args(self):
+        out_dir = os.path.dirname(os.path.abspath(self.output_path))
+        return [
+            "-force_key_frames", f"expr:gte(t,n_forced*{self.segment_duration})",
+            "-f", "hls",
+            "-hls_time", str(self.segment_duration),
+            "-hls_playlist_type", "event",
+            "-hls_segment_type", "fmp4",
+            # segments are written as .tmp and renamed when complete
+            "-hls_flags", "independent_segments+temp_file",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", os.path.join(out_dir, "segment_%05d.m4s"),
+            self.output_path,
+        ]
+
+
+class HLSSegmentWatcher:
+    """Call on_segment(path) for each file a growing HLS playlist references.
+
+    Polls the playlist in a background thread; a file is only reported once
+    ffmpeg has listed it, i.e. once it is complete. The init segment is
+    reported before the first media segment. stop() does a final scan, so
+    every segment is reported by the time it returns.
+    """
+
+    def __init__(self, playlist_path, on_segment, interval=0.5):
+        self.playlist_path = playlist_path
+        self.on_segment = on_segment
+        self.interval = interval
+        self._seen = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _scan(self):
+        if not os.path.exists(self.playlist_path):
+            return
+        with open(self.playlist_path) as f:
+            lines = [line.strip() for line in f]
+        names = []
+        for line in lines:
+            if line.startswith("#EXT-X-MAP:"):
+                names.append(line.split('URI="', 1)[1].split('"', 1)[0])
+            elif line and not line.startswith("#"):
+                names.append(line)
+        out_dir = os.path.dirname(self.playlist_path)
+        for name in names:
+            if name not in self._seen:
+                self._seen.add(name)
+                try:
+                    self.on_segment(os.path.join(out_dir, name))
+                except Exception as e:
+                    print(f"Warning: segment callback failed for {name}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._scan()
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._scan()
@@ -0,0 +1,63 @@
+"""Build and evaluate the --quantize int8 mode on a reference clip.
+
+The clip is rendered in float32 and in int8 on the chosen backend, and the
+script reports the speedup and the PSNR of the int8 output against the
+float32 output. For the onnxruntime backend, the statically quantized UNet is
+built first from UNet inputs recorded while rendering the clip in float32
+(run export_onnx.py before).
+
+    python quantize_int8.py --audio data/audio/yongen.wav --video data/video/yongen.mp4
+    python quantize_int8.py --audio data/audio/yongen.wav --video data/video/yongen.mp4 --backend onnxruntime
+"""
+import argparse
+import os
+import shutil
+import time
+
+from lipsync.engine import InferenceEngine
+from lipsync.quantization import collect_calibration_batches, quantize_onnx_unet, video_psnr
+
+
+def timed_inference(engine, audio, video, output_path):
+    # The first pass fills the whisper and avatar caches, so both modes are timed on warm caches
+    engine.load().warmup()
+    engine.inference(audio, video, 0)
+    start = time.perf_counter()
+    result, _ = engine.inference(audio, video, 0)
+    elapsed = time.perf_counter() - start
+    shutil.move(result, output_path)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", type=str, required=True, help="Reference driving audio")
+    parser.add_argument("--video", type=str, required=True, help="Reference video or image")
+    parser.add_argument("--backend", type=str, default="torch", choices=["torch", "onnxruntime"])
+    parser.add_argument("--onnx_dir", type=str, default=None, help="Graphs written by export_onnx.py")
+    parser.add_argument("--calibration_batches", type=int, default=16, help="Batches recorded for static quantization")
+    parser.add_argument("--out", type=str, default="./results/quantization", help="Where the two renders are kept")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    fp32_path = os.path.join(args.out, "fp32.mp4")
+    int8_path = os.path.join(args.out, "int8.mp4")
+
+    # int8 only runs on the CPU, so fp32 is measured there too
+    fp32_engine = InferenceEngine(device="cpu", backend=args.backend, onnx_dir=args.onnx_dir)
+    fp32_time = timed_inference(fp32_engine, args.audio, args.video, fp32_path)
+
+    if args.backend == "onnxruntime":
+        calibration_engine = InferenceEngine(device="cpu").load()
+        batches = collect_calibration_batches(calibration_engine, args.audio, args.video,
+                                              max_batches=args.calibration_batches)
+        del calibration_engine
+        quantize_onnx_unet(fp32_engine.onnx_dir, batches)
+    del fp32_engine
+
+    int8_engine = InferenceEngine(backend=args.backend, onnx_dir=args.onnx_dir, quantize="int8")
+    int8_time = timed_inference(int8_engine, args.audio, args.video, int8_path)
+
+    print(f"fp32: {fp32_time:.1f} s")
+    print(f"int8: {int8_time:.1f} s ({fp32_time / int8_time:.2f}x)")
+    print(f"PSNR of int8 against fp32: {video_psnr(fp32_path, int8_path):.2f} dB")
@@ -1,29 +1,20 @@
 import os
 import shutil
-import subprocess
 import uuid
-import mimetypes
-from MuseTalk.app import inference
+from lipsync.engine import InferenceEngine, source_type
 from s3_utils import upload_to_s3
 
-def convert_image_to_video(image_path: str, video_path: str, duration: float = 3.0):
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-loop", "1",
-        "-i", image_path,
-        "-c:v", "libx264",
-        "-t", str(duration),
-        "-pix_fmt", "yuv420p",
-        "-vf", "scale=512:512",
-        video_path
-    ]
-    subprocess.run(cmd, check=True)
-    print(f"[INFO] Created dummy video from image: {video_path}")
+# Models are loaded by the handler at cold start, see runpod_handler.py
+engine = InferenceEngine(
+    backend=os.getenv("MUSETALK_BACKEND", "torch"),
+    onnx_dir=os.getenv("ONNX_DIR") or None,
+    quantize=os.getenv("MUSETALK_QUANTIZE") or None,
+    precision=os.getenv("MUSETALK_PRECISION") or None,
+)
 
 def is_image_file(path: str) -> bool:
-    mime_type, _ = mimetypes.guess_type(path)
-    return mime_type and mime_type.startswith("image")
+    # Same check as inference() uses, so unreadable files are rejected here already
+    return source_type(path) == "image"
 
 def generate_video(
     audio_path: str,
@@ -33,25 +24,26 @@ def generate_video(
     extra_margin: int = 10,
     parsing_mode: str = "jaw",
     left_cheek_width: int = 90,
-    right_cheek_width: int = 90
+    right_cheek_width: int = 90,
+    batch_size=8
 ) -> str:
-    # Convert image to video if needed
+    # Still images are fed to inference directly; the face is prepared once
+    # and the output length follows the audio
     if is_image_file(image_path):
-        tmp_video_path = image_path.replace(".jpg", ".mp4").replace(".png", ".mp4")
-        convert_image_to_video(image_path, tmp_video_path)
+        print(f"[INFO] Detected image file: {image_path}")
     else:
-        tmp_video_path = image_path  # already a video
-        print(f"[INFO] Detected video file: {tmp_video_path}")
+        print(f"[INFO] Detected video file: {image_path}")
 
     print(f"[INFO] Running MuseTalk inference...")
-    result_video, _ = inference(
+    result_video, _ = engine.inference(
         audio_path,
-        tmp_video_path,
+        image_path,
         bbox_shift,
         extra_margin,
         parsing_mode,
         left_cheek_width,
-        right_cheek_width
+        right_cheek_width,
+        batch_size=batch_size
     )
 
     if not os.path.exists(result_video):
@@ -73,3 +65,51 @@ def generate_video(
         print(f"[INFO] Uploaded to s3://{bucket}/{s3_key}")
 
     return output_path
+
+def generate_progressive_video(
+    audio_path: str,
+    image_path: str,
+    bucket: str,
+    key_prefix: str,
+    segment_duration: float = 2.0,
+    bbox_shift: float = 0.0,
+    extra_margin: int = 10,
+    parsing_mode: str = "jaw",
+    left_cheek_width: int = 90,
+    right_cheek_width: int = 90,
+    batch_size=8
+) -> str:
+    """
+    Renders the video as an HLS playlist of fMP4 segments and uploads each
+    segment, plus the updated playlist, to S3 as soon as it is written.
+    Returns the S3 key of the playlist.
+    """
+    playlist_key = f"{key_prefix}/index.m3u8"
+
+    def on_segment(path):
+        upload_to_s3(path, bucket, f"{key_prefix}/{os.path.basename(path)}")
+        playlist_path = os.path.join(os.path.dirname(path), "index.m3u8")
+        if os.path.exists(playlist_path):
+            upload_to_s3(playlist_path, bucket, playlist_key)
+        print(f"[INFO] Uploaded segment s3://{bucket}/{key_prefix}/{os.path.basename(path)}")
+
+    print("[INFO] Running progressive MuseTalk inference...")
+    playlist_path, _ = engine.inference(
+        audio_path,
+        image_path,
+        bbox_shift,
+        extra_margin,
+        parsing_mode,
+        left_cheek_width,
+        right_cheek_width,
+        batch_size=batch_size,
+        progressive=True,
+        segment_duration=segment_duration,
+        on_segment=on_segment
+    )
+
+    # Final playlist carries #EXT-X-ENDLIST
+    upload_to_s3(playlist_path, bucket, playlist_key)
+    shutil.rmtree(os.path.dirname(playlist_path), ignore_errors=True)
+    print(f"[INFO] Uploaded playlist to s3://{bucket}/{playlist_key}")
+    return playlist_key
@@ -10,14 +10,15 @@ BASE_DIR = os.path.dirname(__file__)
 sys.path.insert(0, BASE_DIR)
 
 from s3_utils import upload_to_s3, cleanup
-from musetalk_wrapper import generate_video
+from musetalk_wrapper import engine, generate_video, generate_progressive_video
 from download_all_weights import download_all_models
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Download models on cold start
+# Download and load models on cold start, so the first job does not pay for it
 download_all_models()
+engine.load().warmup()
 
 def download_from_url(url, suffix):
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir="/tmp")
@@ -43,10 +44,26 @@ def handler(event):
         video_suffix = os.path.splitext(video_url)[-1] or ".mp4"
         video_path = download_from_url(video_url, video_suffix)
 
+        # "auto" probes the fastest batch size once per device/dtype. It is opt-in: the
+        # tuning cache does not survive serverless workers, so every cold worker would
+        # otherwise re-tune during its first job
+        batch_size = input_data.get("batch_size", 8)
+
+        if input_data.get("progressive"):
+            # HLS segments are uploaded while rendering; clients can start playing
+            # outputs/<id>/index.m3u8 before the job completes
+            key_prefix = f"outputs/{uuid.uuid4().hex}"
+            playlist_key = generate_progressive_video(
+                audio_path, video_path, bucket, key_prefix,
+                segment_duration=float(input_data.get("segment_duration", 2.0)),
+                batch_size=batch_size,
+            )
+            return {"status": "completed", "playlist_key": playlist_key}
+
         output_name = f"output_{uuid.uuid4().hex}.mp4"
         output_path = os.path.join("/tmp", output_name)
 
-        generate_video(audio_path, video_path, output_path)
+        generate_video(audio_path, video_path, output_path, batch_size=batch_size)
 
         output_key = f"outputs/{output_name}"
         upload_to_s3(output_path, bucket, output_key)